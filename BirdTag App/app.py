@@ -253,6 +253,10 @@ def generate_presigned_url():
 # Base API URL for your Lambda functions
 LAMBDA_API_BASE = os.environ.get('LAMBDA_API_BASE', 'https://your-api.amazonaws.com/dev')
 
+def pagination_params():
+    """Forward the optional `limit` and `next_token` query arguments to the search Lambdas"""
+    return {key: request.args[key] for key in ('limit', 'next_token') if request.args.get(key)}
+
 @app.route('/tags-counts-search', methods=['POST'])
 def tags_counts_search():
     """Proxy for search-by-tag Lambda function"""
@@ -264,7 +268,7 @@ def tags_counts_search():
         data = request.get_json()
         
         # Convert to query parameters format expected by Lambda
-        params = {}
+        params = pagination_params()
         i = 1
         for tag, count in data.items():
             params[f'tag{i}'] = tag
@@ -290,7 +294,9 @@ def species_search():
         species = list(data.keys())[0] if data else ""
         
         # Make request to Lambda
-        response = requests.get(f"{LAMBDA_API_BASE}/search-by-species", params={"species": species})
+        params = pagination_params()
+        params["species"] = species
+        response = requests.get(f"{LAMBDA_API_BASE}/search-by-species", params=params)
         
         return jsonify(response.json()), response.status_code
     except Exception as e:
@@ -319,13 +325,20 @@ def file_search():
         return jsonify({"error": "Not authenticated"}), 403
     
     try:
-        # Get uploaded file
-        file = request.files.get('file')
-        if not file:
-            return jsonify({"error": "No file provided"}), 400
+        params = pagination_params()
         
-        # Read file content
-        file_content = file.read()
+        # Later pages carry the detected species in next_token, so no file is re-sent
+        if 'next_token' in params:
+            file_content = b''
+        else:
+            # Get uploaded file
+            file = request.files.get('file')
+            if not file:
+                return jsonify({"error": "No file provided"}), 400
+            
+            # Read file content
+            file_content = file.read()
+            params["filename"] = file.filename
         
         # Get access token from session
         access_token = session.get('access_token')
@@ -338,7 +351,7 @@ def file_search():
         
         response = requests.post(
             f"{LAMBDA_API_BASE}/file_based_search", 
-            params={"filename": file.filename},
+            params=params,
             data=file_content,
             headers=headers
         )
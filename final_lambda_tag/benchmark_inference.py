@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare the inference engines on local images.
+
+Usage (from the repository root):
+    MODEL_PATH=final_lambda_tag/model.pt ONNX_MODEL_PATH=final_lambda_tag/model.onnx \
+        python final_lambda_tag/benchmark_inference.py img1.jpg img2.jpg --runs 20
+
+Each engine runs in a fresh Python process so that "cold start" covers the
+imports and model load a new Lambda container pays. Reported per engine:
+cold start (import + load + first prediction), median warm latency per
+image, peak RSS, and the per-class counts on the first image so the two
+engines can be checked against each other.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+ENGINES = ('ultralytics', 'onnx')
+
+
+def worker(engine, images, runs):
+    import resource
+
+    start = time.perf_counter()
+    from birdtag_common.inference import load_model
+    from birdtag_common.detection_counts import class_counts
+    from birdtag_common.image_decoding import decode_image, MODEL_IMGSZ
+    model = load_model(engine)
+    decoded = []
+    for path in images:
+        with open(path, 'rb') as f:
+            decoded.append(decode_image(f.read()))
+    first = model(decoded[0], imgsz=MODEL_IMGSZ)[0]
+    cold = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(runs):
+        for image in decoded:
+            start = time.perf_counter()
+            model(image, imgsz=MODEL_IMGSZ)
+            latencies.append(time.perf_counter() - start)
+
+    counts = class_counts(first.boxes, model.names)
+
+    print(json.dumps({
+        'engine': engine,
+        'cold_s': cold,
+        'warm_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'counts': counts
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('--worker', choices=ENGINES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.images, args.runs)
+        return
+
+    print(f"{'engine':<12} {'cold s':>8} {'warm ms':>9} {'peak MB':>9}  counts (first image)")
+    for engine in args.engines:
+        output = subprocess.run(
+            [sys.executable, __file__, '--worker', engine, '--runs', str(args.runs), *args.images],
+            capture_output=True, text=True, check=True
+        ).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        print(f"{engine:<12} {report['cold_s']:8.2f} {report['warm_ms']:9.1f} {report['peak_rss_mb']:9.0f}  {report['counts']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Latency and cost of a deployed detection Lambda across memory sizes.
+
+Usage:
+    python final_lambda_tag/benchmark_memory_sizes.py bird-detection event.json \
+        --sizes 1024 1769 3008 5307 10240 --runs 10 --sla-ms 3000
+
+For each memory size the function's configuration is updated (which also
+forces a cold start), then it is invoked once cold and `--runs` times warm
+with `event.json` as the payload. Durations come from the REPORT line of
+each invocation's log tail, and the thread count from the "Runtime profile"
+line the function prints at init. The table shows per size: vCPU share,
+threads, init duration, p50/p95 warm duration, peak memory and the cost of
+one million warm invocations. The cheapest size whose p95 meets `--sla-ms`
+is marked. The original memory size is restored at the end.
+
+Run it once per engine/variant (e.g. with RUNTIME_CHANNELS_LAST on and off)
+to compare them on equal footing.
+"""
+import argparse
+import base64
+import json
+import re
+import statistics
+import boto3
+
+LAMBDA_MB_PER_VCPU = 1769
+# On-demand price per GB-second (us-east-1); pass --price-per-gb-s for arm64 or other regions
+PRICE_PER_GB_S = 0.0000166667
+PRICE_PER_REQUEST = 0.0000002
+
+lambda_client = boto3.client('lambda')
+
+REPORT_FIELDS = {
+    'duration_ms': r'\tDuration: ([\d.]+) ms',
+    'billed_ms': r'Billed Duration: ([\d.]+) ms',
+    'max_memory_mb': r'Max Memory Used: ([\d.]+) MB',
+    'init_ms': r'Init Duration: ([\d.]+) ms'
+}
+
+
+def parse_log(log_result):
+    """REPORT fields and the runtime profile thread count from a base64 log tail."""
+    log = base64.b64decode(log_result).decode('utf-8', errors='replace')
+    report = {}
+    for field, pattern in REPORT_FIELDS.items():
+        match = re.search(pattern, log)
+        if match:
+            report[field] = float(match.group(1))
+    threads = re.search(r"Runtime profile: .*'threads': (\d+)", log)
+    if threads:
+        report['threads'] = int(threads.group(1))
+    return report
+
+
+def invoke(function_name, payload):
+    response = lambda_client.invoke(
+        FunctionName=function_name, Payload=payload, LogType='Tail'
+    )
+    if response.get('FunctionError'):
+        raise RuntimeError(f"Invocation failed: {response['Payload'].read().decode()}")
+    return parse_log(response['LogResult'])
+
+
+def set_memory(function_name, memory_size):
+    lambda_client.update_function_configuration(FunctionName=function_name, MemorySize=memory_size)
+    lambda_client.get_waiter('function_updated_v2').wait(FunctionName=function_name)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(function_name, memory_size, payload, runs, price_per_gb_s):
+    set_memory(function_name, memory_size)
+    cold = invoke(function_name, payload)
+    warm = [invoke(function_name, payload) for _ in range(runs)]
+
+    durations = [r['duration_ms'] for r in warm]
+    billed_s = statistics.mean(r['billed_ms'] for r in warm) / 1000
+    return {
+        'memory_mb': memory_size,
+        'vcpus': round(min(6, memory_size / LAMBDA_MB_PER_VCPU), 2),
+        'threads': cold.get('threads'),
+        'init_ms': cold.get('init_ms'),
+        'p50_ms': statistics.median(durations),
+        'p95_ms': percentile(durations, 0.95),
+        'max_memory_mb': max(r['max_memory_mb'] for r in [cold, *warm]),
+        'cost_per_million': (billed_s * memory_size / 1024 * price_per_gb_s + PRICE_PER_REQUEST) * 1_000_000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('function_name')
+    parser.add_argument('event', help='JSON file with the payload to invoke the function with')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1024, 1769, 3008, 5307, 10240])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--sla-ms', type=float, help='p95 warm duration the chosen size must meet')
+    parser.add_argument('--price-per-gb-s', type=float, default=PRICE_PER_GB_S)
+    args = parser.parse_args()
+
+    with open(args.event) as f:
+        payload = json.dumps(json.load(f)).encode()
+
+    original = lambda_client.get_function_configuration(FunctionName=args.function_name)['MemorySize']
+    rows = []
+    try:
+        for memory_size in args.sizes:
+            rows.append(measure(args.function_name, memory_size, payload, args.runs, args.price_per_gb_s))
+            print(json.dumps(rows[-1]))
+    finally:
+        set_memory(args.function_name, original)
+
+    meeting_sla = [r for r in rows if args.sla_ms is None or r['p95_ms'] <= args.sla_ms]
+    cheapest = min(meeting_sla, key=lambda r: r['cost_per_million'], default=None)
+
+    print(f"\n{'MB':>6} {'vCPU':>5} {'thr':>4} {'init ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'peak MB':>8} {'$/1M':>8}")
+    for r in rows:
+        marker = '  <- cheapest within SLA' if r is cheapest else ''
+        print(f"{r['memory_mb']:>6} {r['vcpus']:>5} {r['threads'] or '-':>4} {r['init_ms'] or 0:>8.0f} "
+              f"{r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['max_memory_mb']:>8.0f} {r['cost_per_million']:>8.2f}{marker}")
+    if cheapest is None:
+        print(f"No size met a p95 of {args.sla_ms} ms")
+
+
+if __name__ == '__main__':
+    main()
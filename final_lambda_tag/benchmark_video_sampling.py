@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Compare the video frame samplers on local files.
+
+Usage (from the repository root):
+    python final_lambda_tag/benchmark_video_sampling.py clip1.mp4 clip2.mov --repeat 3
+
+For each video and mode prints the wall time to produce the sampled frames
+(decode only, no inference) and the frame indices that were picked.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from birdtag_common.video_sampling import SAMPLER_MODES, sample_frames
+
+
+def time_mode(video_path, mode, samples, repeat):
+    best = None
+    indices = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        indices = [idx for idx, _ in sample_frames(video_path, num_samples=samples, mode=mode)]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--samples', type=int, default=None, help='frames per video (default: duration-based)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--modes', nargs='+', default=list(SAMPLER_MODES), choices=SAMPLER_MODES)
+    args = parser.parse_args()
+
+    print(f"{'video':<30} {'mode':<11} {'best s':>8} {'frames':>6}  indices")
+    for video_path in args.videos:
+        for mode in args.modes:
+            best, indices = time_mode(video_path, mode, args.samples, args.repeat)
+            name = os.path.basename(video_path)[:30]
+            print(f"{name:<30} {mode:<11} {best:8.3f} {len(indices):6d}  {indices}")
+
+
+if __name__ == '__main__':
+    main()
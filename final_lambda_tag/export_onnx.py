@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Export model.pt to the ONNX graph used by INFERENCE_ENGINE=onnx.
+
+Usage (from the repository root, with ultralytics and onnx installed):
+    python final_lambda_tag/export_onnx.py final_lambda_tag/model.pt --imgsz 640
+
+Writes model.onnx next to the weights. The export has a dynamic batch axis
+so sampled video frames still go through the model in one call, and keeps
+the class names and input size in the ONNX metadata, which is where
+OnnxDetector reads them from. Copy the file to lambda/search_by_file/ as
+well when both Lambdas are built with Dockerfile.onnx.
+"""
+import argparse
+import os
+import shutil
+
+from ultralytics import YOLO
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('weights')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--opset', type=int, default=None)
+    parser.add_argument('--output', default=None, help='defaults to the weights path with .onnx')
+    args = parser.parse_args()
+
+    exported = YOLO(args.weights).export(
+        format='onnx',
+        imgsz=args.imgsz,
+        dynamic=True,
+        simplify=True,
+        opset=args.opset
+    )
+
+    output = args.output or os.path.splitext(args.weights)[0] + '.onnx'
+    if os.path.abspath(exported) != os.path.abspath(output):
+        shutil.move(exported, output)
+    print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
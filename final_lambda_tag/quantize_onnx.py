@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Quantize the ONNX export to INT8 and compare it against the FP32 graph.
+
+Usage (from the repository root, with onnx and onnxruntime installed):
+    python final_lambda_tag/quantize_onnx.py final_lambda_tag/model.onnx \
+        --bucket g146-a3 --calibration 64 --evaluate 64 --video clip.mp4
+
+Calibration and evaluation images are drawn from the bucket's images/
+prefix (the layout app.upload_file writes to), or from local files with
+--images. The two sets do not overlap. Static quantization (QDQ, per-channel
+INT8 weights, UINT8 activations, convolutions only) is calibrated on the
+first set; --mode dynamic quantizes weights only and needs no calibration.
+
+Writes model.int8.onnx next to the input and prints:
+- per-species count agreement with FP32 on the evaluation set (share of
+  images with identical counts, mean absolute count difference);
+- latency of the process_image path (decode + inference) and, with --video,
+  of the process_video path (sampled frames, batched);
+- peak RSS of a process that loads each model and runs one image.
+
+Deploy it with INFERENCE_ENGINE=onnx and
+    docker build -f final_lambda_tag/Dockerfile.onnx --build-arg ONNX_MODEL=model.int8.onnx .
+"""
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import boto3
+import onnx
+from onnxruntime.quantization import (
+    CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+    quantize_dynamic, quantize_static
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from birdtag_common.detection_counts import class_counts
+from birdtag_common.image_decoding import decode_image
+from birdtag_common.inference import OnnxDetector, prepare_batch
+from birdtag_common.video_sampling import sample_frames
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VIDEO_BATCH_SIZE = 10
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds letterboxed images to the calibrator one at a time."""
+
+    def __init__(self, input_name, images, imgsz):
+        self.input_name = input_name
+        self.images = iter(images)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        image = next(self.images, None)
+        if image is None:
+            return None
+        batch, _ = prepare_batch([image], self.imgsz)
+        return {self.input_name: batch}
+
+
+def bucket_images(bucket, count, prefix='images/'):
+    """Encoded bytes of up to `count` images from the bucket, in listing order."""
+    s3 = boto3.client('s3')
+    images = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            images.append(s3.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read())
+            if len(images) == count:
+                return images
+    return images
+
+
+def local_images(paths):
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def quantize(fp32_path, output_path, calibration, mode):
+    if mode == 'dynamic':
+        quantize_dynamic(fp32_path, output_path, weight_type=QuantType.QInt8)
+    else:
+        detector = OnnxDetector(fp32_path)
+        with tempfile.TemporaryDirectory() as tmp:
+            # Shape inference and graph cleanup recommended before static quantization
+            prepared = os.path.join(tmp, 'prepared.onnx')
+            quant_pre_process(fp32_path, prepared)
+            quantize_static(
+                prepared,
+                output_path,
+                ImageCalibrationReader(detector.input_name, [decode_image(d) for d in calibration], detector.imgsz),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                weight_type=QuantType.QInt8,
+                activation_type=QuantType.QUInt8,
+                calibrate_method=CalibrationMethod.MinMax,
+                # Only the convolutions: the head concatenates pixel box coordinates
+                # with [0, 1] class scores, and one UINT8 scale for both wipes out the scores
+                op_types_to_quantize=['Conv']
+            )
+
+    # Class names and input size live in the metadata OnnxDetector reads
+    source = onnx.load(fp32_path, load_external_data=False)
+    quantized = onnx.load(output_path)
+    onnx.helper.set_model_props(quantized, {p.key: p.value for p in source.metadata_props})
+    onnx.save(quantized, output_path)
+
+
+def species_counts(detector, image):
+    """Counts as the Lambdas record them, zeros included."""
+    counts = class_counts(detector(image)[0].boxes, detector.names)
+    return {name: counts.get(name, 0) for name in detector.names.values()}
+
+
+def agreement(fp32, int8, images):
+    """Per species: share of images where both models count the same, and mean |difference|."""
+    report = {name: {'equal': 0, 'abs_diff': 0} for name in fp32.names.values()}
+    for data in images:
+        image = decode_image(data)
+        expected, actual = species_counts(fp32, image), species_counts(int8, image)
+        for name in report:
+            report[name]['equal'] += expected[name] == actual[name]
+            report[name]['abs_diff'] += abs(expected[name] - actual[name])
+    return {
+        name: (row['equal'] / len(images), row['abs_diff'] / len(images))
+        for name, row in report.items()
+    }
+
+
+def image_latency(detector, images, runs):
+    """Median seconds for decode + inference of one image, as in process_image."""
+    timings = []
+    for _ in range(runs):
+        for data in images:
+            start = time.perf_counter()
+            detector(decode_image(data))
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def video_latency(detector, video_path):
+    """Seconds for the sampled, batched inference of one video, as in process_video."""
+    start = time.perf_counter()
+    batch = []
+    for _, frame in sample_frames(video_path):
+        batch.append(frame)
+        if len(batch) == VIDEO_BATCH_SIZE:
+            detector(batch)
+            batch = []
+    if batch:
+        detector(batch)
+    return time.perf_counter() - start
+
+
+def peak_rss_mb(model_path, image_path):
+    """Peak RSS of a fresh process that loads the model and runs one image."""
+    output = subprocess.run(
+        [sys.executable, __file__, '--rss-worker', model_path, image_path],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def rss_worker(model_path, image_path):
+    detector = OnnxDetector(model_path)
+    with open(image_path, 'rb') as f:
+        detector(decode_image(f.read()))
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--rss-worker':
+        rss_worker(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='FP32 ONNX export (see export_onnx.py)')
+    parser.add_argument('--output', default=None, help='defaults to <model>.int8.onnx')
+    parser.add_argument('--mode', choices=('static', 'dynamic'), default='static')
+    parser.add_argument('--bucket', default='g146-a3')
+    parser.add_argument('--images', nargs='+', default=None, help='local images instead of the bucket')
+    parser.add_argument('--calibration', type=int, default=64)
+    parser.add_argument('--evaluate', type=int, default=64)
+    parser.add_argument('--video', nargs='*', default=[])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.model)[0] + '.int8.onnx'
+    total = args.calibration + args.evaluate
+    images = local_images(args.images) if args.images else bucket_images(args.bucket, total)
+    if len(images) < 2:
+        parser.error("Need at least two images for calibration and evaluation")
+    split = min(args.calibration, len(images) // 2) if args.mode == 'static' else 0
+    calibration, evaluation = images[:split], images[split:]
+
+    print(f"Quantizing ({args.mode}) with {len(calibration)} calibration images...")
+    quantize(args.model, output, calibration, args.mode)
+    print(f"Wrote {output}")
+
+    fp32, int8 = OnnxDetector(args.model), OnnxDetector(output)
+
+    print(f"\nCount agreement on {len(evaluation)} images")
+    print(f"{'species':<12} {'equal':>7} {'mean |diff|':>12}")
+    for name, (equal, diff) in agreement(fp32, int8, evaluation).items():
+        print(f"{name:<12} {equal:7.1%} {diff:12.3f}")
+
+    with tempfile.NamedTemporaryFile(suffix='.img') as sample:
+        sample.write(evaluation[0])
+        sample.flush()
+        print(f"\n{'model':<6} {'image ms':>9} {'video s':>8} {'peak MB':>8}")
+        for label, detector, path in (('fp32', fp32, args.model), ('int8', int8, output)):
+            image_ms = image_latency(detector, evaluation, args.runs) * 1000
+            video_s = f"{sum(video_latency(detector, video) for video in args.video):8.2f}" if args.video else f"{'-':>8}"
+            print(f"{label:<6} {image_ms:9.1f} {video_s} {peak_rss_mb(path, sample.name):8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+"""
+Helpers shared by the BirdTag Lambda functions.
+
+This package is copied next to each Lambda handler when it is deployed
+(see the Dockerfiles under final_lambda_tag/ and lambda/search_by_file/).
+"""
@@ -0,0 +1,93 @@
+"""
+Catalog version number and change log.
+
+The DynamoDB Streams handler (lambda/catalog_index/stream_handler.py) logs
+every write to BirdDetectionsResults in the BirdCatalogChanges table under
+a monotonically increasing sequence number, and keeps the latest number in
+a version item. Readers that hold derived state (warm indexes, caches)
+compare that version with their own and replay only the newer changes.
+
+Sequence numbers are reserved (ADD on the version item) before the rows are
+written. If the write fails partway, the stream retries the whole batch
+under a new range, so the reserved numbers whose rows never landed are a
+permanent hole rather than a pending write. Readers wait GAP_TIMEOUT_SECONDS
+for a hole to fill, then skip it instead of stopping there forever.
+"""
+import os
+import time
+import boto3
+from boto3.dynamodb.conditions import Key
+
+CATALOG_CHANGES_TABLE = os.environ.get('CATALOG_CHANGES_TABLE', 'BirdCatalogChanges')
+# Changes expire through DynamoDB TTL; snapshots must be rebuilt well within this window
+CHANGE_TTL_SECONDS = 7 * 24 * 3600
+# A hole in the sequence older than this is treated as a failed write that was re-logged
+GAP_TIMEOUT_SECONDS = float(os.environ.get('CATALOG_GAP_TIMEOUT_SECONDS', '60'))
+
+VERSION_KEY = {'stream': 'version', 'seq': 0}
+
+dynamodb = boto3.resource('dynamodb')
+changes_table = dynamodb.Table(CATALOG_CHANGES_TABLE)
+
+
+def current_version():
+    """Latest sequence number handed out, 0 for an empty log."""
+    return version_state()[0]
+
+
+def version_state():
+    """(latest sequence number, epoch seconds it was handed out), (0, 0) for an empty log."""
+    item = changes_table.get_item(Key=VERSION_KEY).get('Item')
+    if not item:
+        return 0, 0
+    return int(item['version']), int(item.get('updatedAt', 0))
+
+
+def record_changes(changes):
+    """
+    Append `changes` (dicts with at least a fileID) to the log and bump the
+    version by their number. Returns the new version.
+    """
+    if not changes:
+        return current_version()
+
+    now = int(time.time())
+    response = changes_table.update_item(
+        Key=VERSION_KEY,
+        UpdateExpression='ADD version :n SET updatedAt = :now',
+        ExpressionAttributeValues={':n': len(changes), ':now': now},
+        ReturnValues='UPDATED_NEW'
+    )
+    latest = int(response['Attributes']['version'])
+    expires_at = now + CHANGE_TTL_SECONDS
+
+    with changes_table.batch_writer() as batch:
+        for seq, change in enumerate(changes, start=latest - len(changes) + 1):
+            batch.put_item(Item=dict(change, stream='changes', seq=seq, loggedAt=now, expiresAt=expires_at))
+    return latest
+
+
+def changes_since(version):
+    """
+    Yield logged changes with seq > `version`, in order. A gap followed by a
+    change logged less than GAP_TIMEOUT_SECONDS ago may still fill, so the
+    replay stops there; an older gap is skipped.
+    """
+    expected = version + 1
+    settled = time.time() - GAP_TIMEOUT_SECONDS
+    kwargs = {'KeyConditionExpression': Key('stream').eq('changes') & Key('seq').gt(version)}
+    while True:
+        response = changes_table.query(**kwargs)
+        for item in response.get('Items', []):
+            seq = int(item['seq'])
+            if seq != expected:
+                if int(item.get('loggedAt', 0)) > settled:
+                    return
+                print(f"Skipping catalog changes {expected}-{seq - 1}, never written")
+            yield item
+            expected = seq + 1
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
@@ -0,0 +1,77 @@
+"""
+Content hash -> detections index for skipping repeated inference.
+
+app.upload_file stores every upload under a fresh uuid4 prefix, so the same
+field photo uploaded twice becomes two objects that would both go through
+the model. The detection Lambda hashes each object's content, and when the
+hash (for the current MODEL_VERSION) is already in BirdContentIndex it reuses
+the stored detections instead of running inference.
+
+Items: contentKey ("<modelVersion>#<hash>"), detections, fileType, fileID
+(first file seen with this content), inferenceSeconds (cost of that run),
+and hits / savedSeconds counters for the copies that reused it.
+"""
+import hashlib
+import os
+import boto3
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+CONTENT_INDEX_TABLE = os.environ.get('CONTENT_INDEX_TABLE', 'BirdContentIndex')
+# Bump when the model changes so old detections are not reused
+MODEL_VERSION = os.environ.get('MODEL_VERSION', 'v1')
+
+dynamodb = boto3.resource('dynamodb')
+content_table = dynamodb.Table(CONTENT_INDEX_TABLE)
+
+
+def bytes_hash(data):
+    """Hash of in-memory content (images)."""
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def etag_hash(etag):
+    """
+    Hash from the S3 ETag, for objects that are streamed rather than read
+    (videos). Single-part uploads carry the content MD5; multipart ETags are
+    stable for the same content and part size, which app.upload_file keeps fixed.
+    """
+    return 'etag:' + etag.strip('"')
+
+
+def _content_key(content_hash):
+    return f"{MODEL_VERSION}#{content_hash}"
+
+
+def lookup(content_hash):
+    """Stored detections item for `content_hash`, or None."""
+    return content_table.get_item(Key={'contentKey': _content_key(content_hash)}).get('Item')
+
+
+def remember(content_hash, file_id, file_type, detections, inference_seconds):
+    """Store the detections of a first-seen content hash. The first writer wins."""
+    try:
+        content_table.put_item(
+            Item={
+                'contentKey': _content_key(content_hash),
+                'fileID': file_id,
+                'fileType': file_type,
+                'detections': detections,
+                'inferenceSeconds': Decimal(str(round(inference_seconds, 3))),
+                'hits': 0,
+                'savedSeconds': 0
+            },
+            ConditionExpression='attribute_not_exists(contentKey)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def record_hit(content_hash, saved_seconds):
+    """Count one reuse of the stored detections and the inference time it saved."""
+    content_table.update_item(
+        Key={'contentKey': _content_key(content_hash)},
+        UpdateExpression='ADD hits :one, savedSeconds :saved',
+        ExpressionAttributeValues={':one': 1, ':saved': Decimal(str(saved_seconds))}
+    )
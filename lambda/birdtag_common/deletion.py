@@ -0,0 +1,87 @@
+"""
+Bulk deletion of media files, their thumbnails and their DynamoDB records.
+
+S3 objects are removed with DeleteObjects (up to 1,000 keys per call) and
+records with BatchWriteItem (25 per call); all calls run concurrently and
+the outcome is reported per file.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from birdtag_common.dynamo_batch import batch_get_items, batch_delete_items
+from birdtag_common.species_index import index_table
+
+S3_DELETE_LIMIT = 1000
+DELETE_WORKERS = 8
+
+s3 = boto3.client('s3')
+
+
+def thumbnail_key_for(file_id):
+    """Images have a thumbnail under thumbnails/<filename>; other media do not."""
+    file_extension = file_id.split('.')[-1].lower() if '.' in file_id else ''
+    if file_extension in ['jpg', 'jpeg', 'png']:
+        return f"thumbnails/{file_id.split('/')[-1]}"
+    return None
+
+
+def _delete_s3_chunk(bucket, keys):
+    """Returns {key: error message} for the objects S3 refused to delete."""
+    try:
+        response = s3.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except Exception as e:
+        return {key: str(e) for key in keys}
+    return {error['Key']: error.get('Message', error.get('Code', 'Unknown error'))
+            for error in response.get('Errors', [])}
+
+
+def delete_files(bucket, table, file_ids):
+    """
+    Delete the given files everywhere they are stored.
+
+    Returns (deleted file IDs, [{'fileID': ..., 'error': ...}]).
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+
+    # Detections are needed to find the species index items of each file
+    records = batch_get_items(
+        table,
+        [{'fileID': file_id} for file_id in file_ids],
+        projection='fileID, detections'
+    )
+    index_keys = [
+        {'species': species, 'fileID': record['fileID']}
+        for record in records
+        for species in record.get('detections', {})
+    ]
+
+    object_owner = {}
+    for file_id in file_ids:
+        object_owner[file_id] = file_id
+        thumbnail_key = thumbnail_key_for(file_id)
+        if thumbnail_key:
+            object_owner[thumbnail_key] = file_id
+    object_keys = list(object_owner)
+    s3_chunks = [object_keys[start:start + S3_DELETE_LIMIT] for start in range(0, len(object_keys), S3_DELETE_LIMIT)]
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+        s3_futures = [executor.submit(_delete_s3_chunk, bucket, chunk) for chunk in s3_chunks]
+        record_future = executor.submit(batch_delete_items, table, [{'fileID': file_id} for file_id in file_ids])
+        index_future = executor.submit(batch_delete_items, index_table, index_keys)
+
+        errors = {}
+        for future in s3_futures:
+            for key, message in future.result().items():
+                errors.setdefault(object_owner[key], []).append(f"S3 {key}: {message}")
+        for key in record_future.result():
+            errors.setdefault(key['fileID'], []).append('DynamoDB record not deleted')
+        for key in index_future.result():
+            errors.setdefault(key['fileID'], []).append(f"Species index entry {key['species']} not deleted")
+
+    deleted = [file_id for file_id in file_ids if file_id not in errors]
+    failed = [{'fileID': file_id, 'error': '; '.join(messages)} for file_id, messages in errors.items()]
+    return deleted, failed
@@ -0,0 +1,42 @@
+"""
+Per-species counts from a model result, shared by tagging and search.
+
+Works on the result's class and confidence arrays (torch tensors from
+ultralytics or NumPy arrays from the ONNX backend) with one mask and one
+np.bincount instead of a Python loop over boxes. Both Lambdas use the same
+DETECTION_CONF_THRESHOLD, so what gets tagged and what a search-by-file
+query matches on cannot drift apart.
+"""
+import os
+import numpy as np
+
+# Minimum box confidence counted as a detection
+CONF_THRESHOLD = float(os.environ.get('DETECTION_CONF_THRESHOLD', '0.5'))
+
+
+def to_numpy(values):
+    """NumPy view of a torch tensor or array-like."""
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def class_counts(boxes, names, conf_threshold=CONF_THRESHOLD, classes=None):
+    """
+    {class name: box count} for the boxes above `conf_threshold`, optionally
+    restricted to the class ids in `classes`. Classes without boxes are left out.
+    """
+    cls = to_numpy(boxes.cls).astype(np.int64).reshape(-1)
+    conf = to_numpy(boxes.conf).reshape(-1)
+
+    mask = conf > conf_threshold
+    if classes is not None:
+        mask &= np.isin(cls, classes)
+
+    counts = np.bincount(cls[mask], minlength=len(names))
+    return {names[int(i)]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+
+def species_present(boxes, names, conf_threshold=CONF_THRESHOLD):
+    """Set of class names with at least one box above `conf_threshold`."""
+    return set(class_counts(boxes, names, conf_threshold))
@@ -0,0 +1,180 @@
+"""
+Columnar detection-matrix snapshot for vectorized tag-count queries.
+
+The snapshot is a dense uint16 (files x species) count matrix plus
+per-file arrays (fileID, fileType, URLs), all stored as .npy files in S3
+with rows sorted by fileID. Search Lambdas download them once per
+container into /tmp and open them with np.load(mmap_mode='r'), so a
+threshold query over the whole catalog is a single boolean mask:
+
+    (counts[:, columns] >= thresholds).all(axis=1)
+
+Each snapshot is written under its own prefix (catalog/matrix/<id>/) and
+published by rewriting catalog/matrix/manifest.json, which names that
+prefix. A reader therefore always downloads a complete, consistent set of
+arrays, never a mix of two snapshots. Superseded prefixes are deleted once
+they were replaced more than MATRIX_RETAIN_SECONDS ago, long after any
+reader that saw the old manifest has finished its download.
+
+Requires numpy in the deployment package.
+"""
+import io
+import json
+import os
+import shutil
+import time
+import boto3
+import numpy as np
+
+MATRIX_BUCKET = os.environ.get('SNAPSHOT_BUCKET', 'g146-a3')
+MATRIX_PREFIX = os.environ.get('DETECTION_MATRIX_PREFIX', 'catalog/matrix/')
+MATRIX_LOCAL_DIR = '/tmp/detection-matrix'
+# Seconds between checks for a newer snapshot
+MATRIX_REFRESH_SECONDS = float(os.environ.get('DETECTION_MATRIX_REFRESH_SECONDS', '300'))
+# Superseded snapshot prefixes are kept this long after the manifest moved on
+MATRIX_RETAIN_SECONDS = float(os.environ.get('DETECTION_MATRIX_RETAIN_SECONDS', '900'))
+
+ARRAYS = ['counts', 'file_ids', 'file_types', 'original_urls', 'thumbnail_urls']
+MANIFEST = 'manifest.json'
+
+s3 = boto3.client('s3')
+
+
+def _snapshot_prefixes():
+    """{snapshot id: creation epoch seconds} of the snapshot prefixes in S3."""
+    prefixes = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=MATRIX_BUCKET, Prefix=MATRIX_PREFIX, Delimiter='/'):
+        for common in page.get('CommonPrefixes', []):
+            snapshot_id = common['Prefix'][len(MATRIX_PREFIX):].rstrip('/')
+            try:
+                prefixes[snapshot_id] = int(snapshot_id.rsplit('-', 1)[1])
+            except (IndexError, ValueError):
+                continue
+    return prefixes
+
+
+def _delete_superseded(current_id):
+    """Delete snapshot prefixes whose successor was published more than MATRIX_RETAIN_SECONDS ago."""
+    prefixes = _snapshot_prefixes()
+    ordered = sorted(prefixes, key=prefixes.get)
+    cutoff = time.time() - MATRIX_RETAIN_SECONDS
+    for old, successor in zip(ordered, ordered[1:]):
+        if old == current_id or prefixes[successor] > cutoff:
+            continue
+        keys = [{'Key': f"{MATRIX_PREFIX}{old}/{name}.npy"} for name in ARRAYS]
+        s3.delete_objects(Bucket=MATRIX_BUCKET, Delete={'Objects': keys, 'Quiet': True})
+        print(f"Deleted superseded detection matrix {old}")
+
+
+def write_matrix_snapshot(records, version):
+    """
+    Build the matrix from detection records, upload it under a new prefix,
+    point the manifest at it and clean up prefixes readers no longer use.
+    """
+    records = sorted(records, key=lambda record: record['fileID'])
+    species = sorted({name for record in records for name in (record.get('detections') or {})})
+    column = {name: i for i, name in enumerate(species)}
+
+    counts = np.zeros((len(records), len(species)), dtype=np.uint16)
+    for row, record in enumerate(records):
+        for name, count in (record.get('detections') or {}).items():
+            counts[row, column[name]] = min(int(count), np.iinfo(np.uint16).max)
+
+    arrays = {
+        'counts': counts,
+        'file_ids': np.array([r['fileID'] for r in records], dtype=str),
+        'file_types': np.array([r.get('fileType', '') for r in records], dtype=str),
+        'original_urls': np.array([r.get('originalURL', '') for r in records], dtype=str),
+        'thumbnail_urls': np.array([r.get('thumbnailURL') or '' for r in records], dtype=str)
+    }
+    snapshot_id = f"{version}-{int(time.time())}"
+    prefix = f"{MATRIX_PREFIX}{snapshot_id}/"
+    for name, array in arrays.items():
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        s3.put_object(Bucket=MATRIX_BUCKET, Key=f"{prefix}{name}.npy", Body=buffer.getvalue())
+
+    # The manifest goes last so readers never see it ahead of its arrays
+    manifest = {'version': version, 'id': snapshot_id, 'prefix': prefix, 'species': species, 'files': len(records)}
+    s3.put_object(Bucket=MATRIX_BUCKET, Key=f"{MATRIX_PREFIX}{MANIFEST}", Body=json.dumps(manifest).encode())
+
+    _delete_superseded(snapshot_id)
+    return manifest
+
+
+class DetectionMatrix:
+    """A memory-mapped snapshot opened from a local directory."""
+
+    def __init__(self, directory, manifest):
+        self.version = manifest['version']
+        self.column = {name: i for i, name in enumerate(manifest['species'])}
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r'))
+
+    def find_files(self, requirements, limit, after=None):
+        """
+        One page of records meeting every {species: min_count} requirement,
+        ordered by fileID and starting after fileID `after`.
+        Returns (records, last fileID if there may be more, else None).
+        """
+        if not requirements or any(species not in self.column for species in requirements):
+            return [], None
+
+        start = int(np.searchsorted(self.file_ids, after, side='right')) if after else 0
+        columns = [self.column[species] for species in requirements]
+        thresholds = np.array(list(requirements.values()))
+        mask = (self.counts[start:, columns] >= thresholds).all(axis=1)
+        rows = np.flatnonzero(mask) + start
+
+        page = rows[:limit]
+        records = [
+            {
+                'fileID': str(self.file_ids[row]),
+                'fileType': str(self.file_types[row]),
+                'originalURL': str(self.original_urls[row]),
+                'thumbnailURL': str(self.thumbnail_urls[row])
+            }
+            for row in page
+        ]
+        last_id = records[-1]['fileID'] if len(rows) > limit else None
+        return records, last_id
+
+
+def _download_snapshot():
+    manifest_object = s3.get_object(Bucket=MATRIX_BUCKET, Key=f"{MATRIX_PREFIX}{MANIFEST}")
+    manifest = json.loads(manifest_object['Body'].read())
+    # Manifests from before versioned prefixes point at the arrays next to them
+    snapshot_id = manifest.get('id', str(manifest['version']))
+    prefix = manifest.get('prefix', MATRIX_PREFIX)
+
+    # One directory per snapshot, so a refresh never rewrites a mapped file
+    directory = os.path.join(MATRIX_LOCAL_DIR, snapshot_id)
+    if os.path.isdir(MATRIX_LOCAL_DIR):
+        for old in os.listdir(MATRIX_LOCAL_DIR):
+            if old != snapshot_id:
+                shutil.rmtree(os.path.join(MATRIX_LOCAL_DIR, old), ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    for name in ARRAYS:
+        s3.download_file(MATRIX_BUCKET, f"{prefix}{name}.npy", os.path.join(directory, f"{name}.npy"))
+    return DetectionMatrix(directory, manifest), manifest_object['ETag']
+
+
+_matrix = None
+_manifest_etag = None
+_checked_at = 0.0
+
+
+def get_detection_matrix():
+    """The container's snapshot, downloaded on first use and when a newer one is published."""
+    global _matrix, _manifest_etag, _checked_at
+    now = time.monotonic()
+    if _matrix is None:
+        _matrix, _manifest_etag = _download_snapshot()
+        _checked_at = now
+    elif now - _checked_at >= MATRIX_REFRESH_SECONDS:
+        _checked_at = now
+        head = s3.head_object(Bucket=MATRIX_BUCKET, Key=f"{MATRIX_PREFIX}{MANIFEST}")
+        if head['ETag'] != _manifest_etag:
+            _matrix, _manifest_etag = _download_snapshot()
+    return _matrix
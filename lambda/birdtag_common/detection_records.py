@@ -0,0 +1,69 @@
+"""
+Idempotent writes of BirdDetectionsResults records.
+
+EventBridge and SQS deliver at least once, so the detection Lambda can see
+the same upload more than once. Every record carries the ETag of the object
+it was computed from (sourceETag) and the MODEL_VERSION that computed it.
+A delivery whose object and model match the stored record is a duplicate:
+is_current() spots it from one get_item before any download or inference,
+and put_record() writes conditionally so a duplicate that slips past the
+check still cannot overwrite. The species index is synced after the put, so
+a skipped delivery re-puts the stored record's index items in case the run
+that stored it failed in between.
+
+Bulk tag edits stamp the record with tagsEditedAt. A hand-edited record
+keeps its counts until the object itself changes: a redelivery or a new
+model version does not overwrite it, a new ETag does.
+"""
+from botocore.exceptions import ClientError
+
+from birdtag_common.content_index import MODEL_VERSION
+
+# Set by manual tag edits (epoch seconds)
+EDITED_AT = 'tagsEditedAt'
+
+# Write unless the stored record is current for this object: a different
+# object, or the same object without manual edits and from an older model
+# (or from before ETags were recorded)
+WRITE_CONDITION = (
+    'attribute_not_exists(fileID)'
+    ' OR sourceETag <> :etag'
+    ' OR (attribute_not_exists(sourceETag) AND attribute_not_exists(#edited))'
+    ' OR (modelVersion <> :model AND attribute_not_exists(#edited))'
+)
+
+
+def normalize_etag(etag):
+    """ETag without the quotes S3 puts around it in HEAD/GET (but not in events)."""
+    return etag.strip('"') if etag else None
+
+
+def is_current(item, etag):
+    """Whether the stored record `item` already covers the object with `etag`."""
+    if not item:
+        return False
+    source = item.get('sourceETag')
+    if EDITED_AT in item:
+        return source in (etag, None)
+    return source == etag and item.get('modelVersion') == MODEL_VERSION
+
+
+def put_record(table, record):
+    """
+    Write `record` (which carries sourceETag and modelVersion) unless the
+    stored one is current. Returns the previous item ({} if there was none),
+    or None when the write was skipped.
+    """
+    try:
+        response = table.put_item(
+            Item=record,
+            ReturnValues='ALL_OLD',
+            ConditionExpression=WRITE_CONDITION,
+            ExpressionAttributeNames={'#edited': EDITED_AT},
+            ExpressionAttributeValues={':etag': record['sourceETag'], ':model': record['modelVersion']}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return None
+    return response.get('Attributes', {})
@@ -0,0 +1,84 @@
+"""
+Batched DynamoDB key lookups.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+MAX_RETRIES = 8
+
+
+def batch_get_items(table, keys, projection=None, expression_attribute_names=None, consistent_read=False):
+    """
+    Fetch the items for `keys` with BatchGetItem, 100 keys per call.
+
+    UnprocessedKeys (throttling, 16 MB response limit) are retried with
+    exponential backoff. Missing items are simply absent from the result;
+    order is not preserved.
+    """
+    unique_keys = []
+    seen = set()
+    for key in keys:
+        marker = tuple(sorted(key.items()))
+        if marker not in seen:
+            seen.add(marker)
+            unique_keys.append(key)
+
+    items = []
+    for start in range(0, len(unique_keys), BATCH_GET_LIMIT):
+        request = {'Keys': unique_keys[start:start + BATCH_GET_LIMIT]}
+        if projection:
+            request['ProjectionExpression'] = projection
+        if expression_attribute_names:
+            request['ExpressionAttributeNames'] = expression_attribute_names
+        if consistent_read:
+            request['ConsistentRead'] = True
+
+        request_items = {table.name: request}
+        attempt = 0
+        while request_items:
+            response = table.meta.client.batch_get_item(RequestItems=request_items)
+            items.extend(response.get('Responses', {}).get(table.name, []))
+
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise Exception(f"BatchGetItem left unprocessed keys after {MAX_RETRIES} retries")
+                time.sleep(min(0.05 * (2 ** attempt), 2))
+
+    return items
+
+
+def _delete_chunk(table, keys):
+    request_items = {table.name: [{'DeleteRequest': {'Key': key}} for key in keys]}
+    attempt = 0
+    while request_items:
+        try:
+            response = table.meta.client.batch_write_item(RequestItems=request_items)
+        except Exception as e:
+            print(f"BatchWriteItem failed on {table.name}: {str(e)}")
+            return [request['DeleteRequest']['Key'] for request in request_items[table.name]]
+
+        request_items = response.get('UnprocessedItems') or {}
+        if request_items:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                return [request['DeleteRequest']['Key'] for request in request_items[table.name]]
+            time.sleep(min(0.05 * (2 ** attempt), 2))
+    return []
+
+
+def batch_delete_items(table, keys, max_workers=8):
+    """
+    Delete `keys` with BatchWriteItem, 25 keys per call and calls running
+    concurrently. Returns the keys that could not be deleted.
+    """
+    chunks = [keys[start:start + BATCH_WRITE_LIMIT] for start in range(0, len(keys), BATCH_WRITE_LIMIT)]
+    if not chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        results = executor.map(lambda chunk: _delete_chunk(table, chunk), chunks)
+        return [key for failed in results for key in failed]
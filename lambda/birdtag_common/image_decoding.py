@@ -0,0 +1,83 @@
+"""
+In-memory image decoding at the resolution the model actually uses.
+
+YOLO letterboxes every input to MODEL_IMGSZ (640 by default), so decoding
+a 24MP camera image at full size only to have it shrunk again wastes most
+of the decode time and memory. decode_image reads the width and height from
+the JPEG SOF / PNG IHDR header and picks the largest IMREAD_REDUCED_COLOR_*
+factor that still leaves the long side at or above the model's input size.
+For JPEG the reduction happens inside the DCT, so the skipped pixels are
+never decoded.
+"""
+import os
+import struct
+import cv2
+import numpy as np
+
+MODEL_IMGSZ = int(os.environ.get('MODEL_IMGSZ', '640'))
+
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Start-of-frame markers carry the dimensions; C4, C8 and CC share the range but do not
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _jpeg_dimensions(data):
+    offset = 2
+    size = len(data)
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length field
+            offset += 2
+            continue
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in SOF_MARKERS:
+            if offset + 9 > size:
+                return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def image_dimensions(data):
+    """(width, height) from a JPEG or PNG header, or None if it cannot be read."""
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_dimensions(data)
+    if data[:8] == PNG_SIGNATURE and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    return None
+
+
+def reduced_decode_flag(width, height, imgsz=MODEL_IMGSZ):
+    """The coarsest imread flag that keeps the long side at or above `imgsz`."""
+    long_side = max(width, height)
+    for factor, flag in REDUCED_FLAGS:
+        if -(-long_side // factor) >= imgsz:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(data, imgsz=MODEL_IMGSZ):
+    """Decode encoded image bytes (no copy of the buffer) at a model-sized resolution."""
+    buffer = np.frombuffer(data, np.uint8)
+    dimensions = image_dimensions(data)
+    flag = reduced_decode_flag(*dimensions, imgsz=imgsz) if dimensions else cv2.IMREAD_COLOR
+
+    img = cv2.imdecode(buffer, flag)
+    if img is None and flag != cv2.IMREAD_COLOR:
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    return img
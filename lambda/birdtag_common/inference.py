@@ -0,0 +1,269 @@
+"""
+Pluggable detection backends.
+
+load_model() returns an object that is called like an ultralytics YOLO
+model: model(image_or_list, imgsz=...) gives one result per image, each with
+an iterable `boxes` whose items have `cls`, `conf` and `xyxy`, and
+model.names maps class ids to names. The Lambdas only rely on that surface.
+
+Engines (INFERENCE_ENGINE):
+
+- "ultralytics": model.pt through ultralytics/torch, the original path.
+- "onnx": an ONNX export of the same weights (see
+  final_lambda_tag/export_onnx.py) run with onnxruntime. Letterboxing and
+  NMS are done in NumPy, so neither torch nor ultralytics is imported and
+  the container can be built without them (Dockerfile.onnx).
+"""
+import ast
+import json
+import os
+import time
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from birdtag_common.image_decoding import MODEL_IMGSZ
+from birdtag_common.runtime_profile import configure, configure_torch, onnx_session_options
+
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'ultralytics')
+MODEL_PATH = os.environ.get('MODEL_PATH', '/var/task/model.pt')
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', '/var/task/model.onnx')
+
+# Run one inference while the Lambda is still initialising
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1') == '1'
+
+# Filled in by load_model: engine, load_s, warmup_s
+LOAD_TIMINGS = {}
+
+# Same defaults as ultralytics predict()
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+MAX_NMS_CANDIDATES = 30000
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+def letterbox(image, size):
+    """
+    Resize keeping the aspect ratio and pad to a `size` x `size` square.
+    Returns the padded image, the scale and the (left, top) padding.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    pad_x, pad_y = (size - new_width) / 2, (size - new_height) / 2
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return image, scale, (left, top)
+
+
+def prepare_batch(images, size):
+    """
+    Letterbox BGR images into one NCHW float32 RGB batch in [0, 1], the input
+    the exported graph expects. Returns the batch and, per image, what is
+    needed to map boxes back to it.
+    """
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    transforms = []
+    for i, image in enumerate(images):
+        padded, scale, pad = letterbox(image, size)
+        batch[i] = padded[:, :, ::-1].transpose(2, 0, 1) / 255.0
+        transforms.append((scale, pad, image.shape[:2]))
+    return batch, transforms
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression. Returns kept indices, best score first."""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[best] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, classes, iou_threshold):
+    """Per-class NMS in one pass, by shifting each class's boxes apart."""
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    offsets = classes[:, None] * (boxes.max() + 1)
+    return nms(boxes + offsets, scores, iou_threshold)
+
+
+class Box:
+    __slots__ = ('cls', 'conf', 'xyxy')
+
+    def __init__(self, cls, conf, xyxy):
+        self.cls = cls
+        self.conf = conf
+        self.xyxy = xyxy
+
+
+class Boxes:
+    """Detections of one image as arrays; iterating yields one Box per detection."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.cls)
+
+    def __iter__(self):
+        for i in range(len(self.cls)):
+            yield Box(float(self.cls[i]), float(self.conf[i]), self.xyxy[i])
+
+
+class Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class OnnxDetector:
+    """YOLO detection head exported to ONNX, run with onnxruntime."""
+
+    def __init__(self, path=ONNX_MODEL_PATH):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            path, sess_options=onnx_session_options(), providers=['CPUExecutionProvider']
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Exports without dynamic=True have a fixed batch of 1
+        self.max_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names'])
+        self.imgsz = ast.literal_eval(metadata.get('imgsz', '[640, 640]'))[0]
+
+    def postprocess(self, prediction, transform, conf_threshold):
+        # (4 + classes, anchors) -> (anchors, 4 + classes)
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+
+        mask = scores > conf_threshold
+        boxes, scores, classes = prediction[mask, :4], scores[mask], classes[mask]
+        if len(scores) > MAX_NMS_CANDIDATES:
+            top = scores.argsort()[::-1][:MAX_NMS_CANDIDATES]
+            boxes, scores, classes = boxes[top], scores[top], classes[top]
+
+        # cx, cy, w, h -> x1, y1, x2, y2
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+
+        keep = batched_nms(xyxy, scores, classes, IOU_THRESHOLD)[:MAX_DETECTIONS]
+        xyxy, scores, classes = xyxy[keep], scores[keep], classes[keep]
+
+        # Undo the letterbox
+        scale, (left, top), (height, width) = transform
+        xyxy -= np.array([left, top, left, top], dtype=xyxy.dtype)
+        xyxy /= scale
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+        return Result(Boxes(xyxy, scores, classes.astype(np.float32)))
+
+    def __call__(self, source, imgsz=None, conf=CONF_THRESHOLD, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        size = imgsz or self.imgsz
+        step = self.max_batch or len(images) or 1
+
+        results = []
+        for start in range(0, len(images), step):
+            chunk = images[start:start + step]
+            batch, transforms = prepare_batch(chunk, size)
+            predictions = self.session.run(None, {self.input_name: batch})[0]
+            results.extend(
+                self.postprocess(prediction, transform, conf)
+                for prediction, transform in zip(predictions, transforms)
+            )
+        return results
+
+
+@contextmanager
+def _torch_checkpoint_load():
+    """
+    For the duration of the block, let torch.load unpickle the full ultralytics
+    checkpoint (weights_only=False) and memory-map it instead of reading it into
+    memory. The override is scoped to the model load, not process-wide.
+    """
+    import torch
+    original_load = torch.load
+
+    def checkpoint_load(f, *args, **kwargs):
+        kwargs.setdefault('weights_only', False)
+        if isinstance(f, (str, os.PathLike)) and 'mmap' not in kwargs:
+            try:
+                return original_load(f, *args, mmap=True, **kwargs)
+            except RuntimeError:
+                # Legacy (non-zip) checkpoints cannot be memory-mapped
+                pass
+        return original_load(f, *args, **kwargs)
+
+    torch.load = checkpoint_load
+    try:
+        yield
+    finally:
+        torch.load = original_load
+
+
+def _load_ultralytics(path):
+    # Lambda's home directory is read-only; keep ultralytics' settings file in /tmp
+    os.environ.setdefault('YOLO_CONFIG_DIR', '/tmp/Ultralytics')
+    from ultralytics import YOLO
+
+    # Weights are read in place from the read-only /var/task, no /tmp copy
+    with _torch_checkpoint_load():
+        model = YOLO(path)
+    return configure_torch(model)
+
+
+def _warm_up(model, imgsz):
+    """One inference on a blank image so the first request does not pay for lazy init."""
+    model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+
+
+def load_model(engine=None, warm_up=MODEL_WARMUP):
+    """
+    Load the detection model for `engine` (default: INFERENCE_ENGINE) and warm
+    it up. Meant to be called at import time, during the Lambda init phase,
+    which runs with boosted CPU. Thread pools are sized by the runtime
+    profile first. Load and warm-up times are kept in LOAD_TIMINGS and logged.
+    """
+    engine = engine or INFERENCE_ENGINE
+    profile = configure()
+    start = time.perf_counter()
+    if engine == 'onnx':
+        model = OnnxDetector(ONNX_MODEL_PATH)
+    elif engine == 'ultralytics':
+        model = _load_ultralytics(MODEL_PATH)
+    else:
+        raise ValueError(f"Unknown inference engine: {engine}")
+    loaded = time.perf_counter()
+
+    if warm_up:
+        _warm_up(model, MODEL_IMGSZ)
+
+    LOAD_TIMINGS.update({
+        'engine': engine,
+        'threads': profile['threads'],
+        'load_s': round(loaded - start, 3),
+        'warmup_s': round(time.perf_counter() - loaded, 3) if warm_up else None
+    })
+    print(f"Model load timings: {json.dumps(LOAD_TIMINGS)}")
+    return model
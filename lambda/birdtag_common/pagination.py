@@ -0,0 +1,55 @@
+"""
+Page-size limits and opaque next_token cursors for the search endpoints.
+
+A token is the URL-safe base64 of a small JSON document (typically a
+DynamoDB LastEvaluatedKey plus whatever the search needs to resume).
+"""
+import base64
+import json
+from decimal import Decimal
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidPageRequest(ValueError):
+    """Raised for a malformed limit or next_token."""
+
+
+def json_default(o):
+    """json.dumps `default` hook for the Decimals boto3 returns: ints stay ints."""
+    if isinstance(o, Decimal):
+        return int(o) if o % 1 == 0 else float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def encode_token(state):
+    """Encode resume state as an opaque token, or None when there is nothing left."""
+    if state is None:
+        return None
+    raw = json.dumps(state, default=json_default, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_token(token):
+    """Inverse of encode_token; None/empty means "first page"."""
+    if not token:
+        return None
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise InvalidPageRequest('Invalid next_token')
+    if not isinstance(state, dict):
+        raise InvalidPageRequest('Invalid next_token')
+    return state
+
+
+def parse_limit(value):
+    """Clamp a requested page size into 1..MAX_PAGE_SIZE."""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise InvalidPageRequest('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
@@ -0,0 +1,164 @@
+"""
+Search result cache keyed on the canonical query and the catalog version.
+
+Two tiers: an in-process LRU (per warm container) and an optional shared
+tier, either a DynamoDB table with TTL or a file-backed stand-in for local
+runs. Keys include the catalog version from the change log, so any
+detection, tag or deletion write (each bumps the version through the
+stream handler) makes earlier entries unreachable; TTLs bound staleness
+if the stream lags.
+
+The stream handler is therefore required. Without it the version item
+never exists, every key would carry version 0 and stale pages would be
+served for the whole TTL, so caching stays off until the item appears.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import boto3
+
+from birdtag_common.catalog_version import current_version
+from birdtag_common.pagination import json_default
+
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', '300'))
+# '' (in-process only), 'dynamodb' or 'file'
+RESULT_CACHE_SHARED = os.environ.get('RESULT_CACHE_SHARED', '')
+RESULT_CACHE_TABLE = os.environ.get('RESULT_CACHE_TABLE', 'BirdSearchCache')
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '/tmp/birdtag-search-cache')
+
+
+def cache_key(kind, requirements, limit, next_token, version):
+    """Same query, page and catalog version -> same key, whatever the input order or case."""
+    canonical = {
+        'kind': kind,
+        'requirements': sorted((species.capitalize(), int(count)) for species, count in requirements.items()),
+        'limit': limit,
+        'next_token': next_token or None,
+        'version': version
+    }
+    return hashlib.sha256(json.dumps(canonical, separators=(',', ':')).encode()).hexdigest()
+
+
+class LocalCache:
+    """Bounded LRU with per-entry expiry."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class DynamoCache:
+    """Shared tier in a table keyed on `cacheKey`, expired by DynamoDB TTL on `expiresAt`."""
+
+    def __init__(self, table_name, ttl):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.ttl = ttl
+
+    def get(self, key):
+        item = self.table.get_item(Key={'cacheKey': key}).get('Item')
+        # TTL deletion is lazy, so expiry is checked here as well
+        if not item or item['expiresAt'] < time.time():
+            return None
+        return json.loads(item['body'])
+
+    def put(self, key, value):
+        self.table.put_item(Item={
+            'cacheKey': key,
+            'body': json.dumps(value, default=json_default),
+            'expiresAt': int(time.time()) + self.ttl
+        })
+
+
+class FileCache:
+    """Shared-tier stand-in: one JSON file per key in a local directory."""
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expiresAt'] < time.time():
+            return None
+        return entry['body']
+
+    def put(self, key, value):
+        # Write then rename, so concurrent readers never see half a file
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'expiresAt': time.time() + self.ttl, 'body': value}, f, default=json_default)
+        os.replace(tmp_path, self._path(key))
+
+
+local_cache = LocalCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+if RESULT_CACHE_SHARED == 'dynamodb':
+    shared_cache = DynamoCache(RESULT_CACHE_TABLE, RESULT_CACHE_TTL)
+elif RESULT_CACHE_SHARED == 'file':
+    shared_cache = FileCache(RESULT_CACHE_DIR, RESULT_CACHE_TTL)
+else:
+    shared_cache = None
+
+
+def cached_search(kind, requirements, limit, next_token, compute):
+    """
+    Return the cached response body for this search page, or call `compute()`
+    and cache what it returns. Nothing is cached while there is no catalog
+    version to key on.
+    """
+    version = current_version()
+    if not version:
+        print("No catalog version item (is the catalog stream handler deployed?), not caching")
+        return compute()
+    key = cache_key(kind, requirements, limit, next_token, version)
+
+    body = local_cache.get(key)
+    if body is not None:
+        return body
+
+    if shared_cache:
+        try:
+            body = shared_cache.get(key)
+        except Exception as e:
+            print(f"Shared result cache read failed: {str(e)}")
+        if body is not None:
+            local_cache.put(key, body)
+            return body
+
+    body = compute()
+    local_cache.put(key, body)
+    if shared_cache:
+        try:
+            shared_cache.put(key, body)
+        except Exception as e:
+            print(f"Shared result cache write failed: {str(e)}")
+    return body
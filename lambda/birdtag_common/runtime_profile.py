@@ -0,0 +1,117 @@
+"""
+Thread pools sized to the CPU a Lambda actually gets.
+
+Lambda allocates CPU in proportion to memory (one full vCPU at 1769 MB, up
+to six at 10240 MB), but os.cpu_count() reports the host's visible cores: a
+1024 MB function sees two cores and gets about 0.6 of one. torch, OpenCV
+and onnxruntime all size their pools from the visible count, so small sizes
+oversubscribe and thrash while large sizes may not use everything they pay
+for. detect() works out the usable cores at init, and configure() sets
+OpenCV's threads; load_model() applies the same count to torch or the
+onnxruntime session. RUNTIME_THREADS overrides the detected value.
+
+Compare memory sizes with final_lambda_tag/benchmark_memory_sizes.py.
+"""
+import os
+import cv2
+
+# Memory at which Lambda allocates one full vCPU
+LAMBDA_MB_PER_VCPU = 1769
+
+# Thread count override; empty means detect from cores and memory
+RUNTIME_THREADS = os.environ.get('RUNTIME_THREADS', '')
+# Convert the torch model to channels-last memory format
+RUNTIME_CHANNELS_LAST = os.environ.get('RUNTIME_CHANNELS_LAST', '0') == '1'
+
+# Filled in by configure(): cores, memory_mb, vcpus, threads
+PROFILE = {}
+
+
+def _cgroup_cpu_limit():
+    """CPU quota from cgroup v2 (cpu.max), or None when unlimited or unavailable."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if quota == 'max':
+        return None
+    return int(quota) / int(period)
+
+
+def visible_cores():
+    """Cores this process may be scheduled on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def memory_mb():
+    """Configured Lambda memory, or the machine's physical memory elsewhere."""
+    configured = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if configured:
+        return int(configured)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def detect():
+    """Cores, memory, the CPU share they amount to, and the thread count to use."""
+    cores = visible_cores()
+    memory = memory_mb()
+
+    vcpus = float(cores)
+    quota = _cgroup_cpu_limit()
+    if quota:
+        vcpus = min(vcpus, quota)
+    if os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE'):
+        vcpus = min(vcpus, memory / LAMBDA_MB_PER_VCPU)
+
+    # Below one vCPU a second thread only adds contention
+    threads = int(RUNTIME_THREADS) if RUNTIME_THREADS else max(1, int(round(vcpus)))
+    return {'cores': cores, 'memory_mb': memory, 'vcpus': round(vcpus, 2), 'threads': threads}
+
+
+def configure():
+    """Detect the profile once and size OpenCV's pool from it. Returns PROFILE."""
+    if not PROFILE:
+        PROFILE.update(detect())
+        cv2.setNumThreads(PROFILE['threads'])
+        print(f"Runtime profile: {PROFILE}")
+    return PROFILE
+
+
+def configure_torch(model):
+    """
+    Size torch's pools and put an ultralytics model in inference configuration.
+    ultralytics already runs predict() under torch.inference_mode; autograd is
+    also switched off process-wide so nothing outside predict() records graphs.
+    """
+    import torch
+
+    threads = configure()['threads']
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before the first parallel op, e.g. not on a second load
+        pass
+    torch.set_grad_enabled(False)
+
+    if RUNTIME_CHANNELS_LAST:
+        model.model.to(memory_format=torch.channels_last)
+    return model
+
+
+def onnx_session_options():
+    """onnxruntime SessionOptions with the intra-op pool sized to the profile."""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = configure()['threads']
+    options.inter_op_num_threads = 1
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
@@ -0,0 +1,112 @@
+"""
+Sliced (tiled) inference for very high-resolution images.
+
+Letterboxed to 640px, a small bird in a 6000x4000 frame covers a few pixels
+and is missed. In sliced mode the full-resolution image is cut into
+overlapping SLICE_TILE_SIZE tiles that go through the model as batches,
+alongside one pass over the whole image for birds larger than a tile. Tile
+boxes are shifted back into image coordinates and merged per class: a box
+is folded into a higher-scoring box of the same class when most of it lies
+inside it (intersection over the smaller box). This catches both duplicates
+from overlapping tiles and the partial boxes of a bird cut by a tile edge.
+
+Only images of at least SLICE_MIN_PIXELS go this way; everything else stays
+on the single reduced-resolution pass.
+"""
+import os
+import numpy as np
+from birdtag_common.detection_counts import CONF_THRESHOLD, to_numpy
+from birdtag_common.image_decoding import MODEL_IMGSZ, image_dimensions
+from birdtag_common.inference import Boxes
+
+SLICED_INFERENCE = os.environ.get('SLICED_INFERENCE', '0') == '1'
+SLICE_MIN_PIXELS = int(os.environ.get('SLICE_MIN_PIXELS', '20000000'))
+SLICE_TILE_SIZE = int(os.environ.get('SLICE_TILE_SIZE', '1280'))
+SLICE_OVERLAP = float(os.environ.get('SLICE_OVERLAP', '0.2'))
+SLICE_BATCH_SIZE = int(os.environ.get('SLICE_BATCH_SIZE', '8'))
+# Intersection over the smaller box above which two same-class boxes are one bird
+SLICE_MERGE_THRESHOLD = float(os.environ.get('SLICE_MERGE_THRESHOLD', '0.6'))
+
+
+def needs_slicing(image_bytes):
+    """Whether sliced mode is on and the image (from its header) is large enough."""
+    if not SLICED_INFERENCE:
+        return False
+    dimensions = image_dimensions(image_bytes)
+    return bool(dimensions) and dimensions[0] * dimensions[1] >= SLICE_MIN_PIXELS
+
+
+def _starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Last tile flush with the edge instead of running past it
+    starts.append(length - tile)
+    return starts
+
+
+def tile_windows(width, height, tile=SLICE_TILE_SIZE, overlap=SLICE_OVERLAP):
+    """(x0, y0, x1, y1) windows of `tile` pixels overlapping by `overlap`, covering the image."""
+    stride = max(1, int(tile * (1 - overlap)))
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in _starts(height, tile, stride)
+        for x in _starts(width, tile, stride)
+    ]
+
+
+def merge_boxes(xyxy, conf, cls, threshold=SLICE_MERGE_THRESHOLD):
+    """
+    Greedy per-class merge on intersection over the smaller box. Each kept box
+    grows to the union of the boxes merged into it, so a bird cut by a tile
+    edge keeps its full extent. Returns (xyxy, conf, cls) of the kept boxes.
+    """
+    x1, y1, x2, y2 = xyxy.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = conf.argsort(kind='stable')[::-1]
+    merged = []
+    while order.size:
+        best = order[0]
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        overlap = inter_w * inter_h / (np.minimum(areas[best], areas[rest]) + 1e-9)
+        duplicate = (overlap > threshold) & (cls[rest] == cls[best])
+        group = xyxy[np.concatenate(([best], rest[duplicate]))]
+        merged.append((*group[:, :2].min(axis=0), *group[:, 2:].max(axis=0), conf[best], cls[best]))
+        order = rest[~duplicate]
+    merged = np.array(merged, dtype=np.float32).reshape(-1, 6)
+    return merged[:, :4], merged[:, 4], merged[:, 5]
+
+
+def _collect(result, offset, parts):
+    boxes = result.boxes
+    conf = to_numpy(boxes.conf).reshape(-1)
+    # Boxes below the counting threshold cannot be counted, so they need not be merged
+    mask = conf > CONF_THRESHOLD
+    if not mask.any():
+        return
+    xyxy = to_numpy(boxes.xyxy).reshape(-1, 4)[mask].astype(np.float32)
+    xyxy += np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float32)
+    parts.append((xyxy, conf[mask].astype(np.float32), to_numpy(boxes.cls).reshape(-1)[mask].astype(np.float32)))
+
+
+def sliced_predict(model, image, tile=SLICE_TILE_SIZE, overlap=SLICE_OVERLAP,
+                   batch_size=SLICE_BATCH_SIZE, imgsz=MODEL_IMGSZ):
+    """Boxes for a full-resolution BGR image from overlapping tiles plus one whole-image pass."""
+    height, width = image.shape[:2]
+    windows = tile_windows(width, height, tile, overlap)
+
+    parts = []
+    _collect(model(image, imgsz=imgsz)[0], (0, 0), parts)
+    for start in range(0, len(windows), batch_size):
+        chunk = windows[start:start + batch_size]
+        crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in chunk]
+        for (x0, y0, _, _), result in zip(chunk, model(crops, imgsz=imgsz)):
+            _collect(result, (x0, y0), parts)
+
+    if not parts:
+        return Boxes(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32))
+
+    xyxy, conf, cls = (np.concatenate(column) for column in zip(*parts))
+    return Boxes(*merge_boxes(xyxy, conf, cls))
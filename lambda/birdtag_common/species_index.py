@@ -0,0 +1,194 @@
+"""
+Species -> fileID inverted index.
+
+Every file in BirdDetectionsResults gets one item per detected species in
+the BirdSpeciesIndex table (partition key `species`, sort key `fileID`).
+The item carries the file's type and URLs, so a species search is a single
+Query whose cost grows with the number of matches, not the catalog size.
+
+The `species-count-index` GSI re-keys the same items by a zero-padded count
+(`countKey`), so "at least N of a species" becomes a range query.
+
+Searches are returned a page at a time; the state needed to resume (the
+query's LastEvaluatedKey) is handed back to the caller for its next_token.
+"""
+import os
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from birdtag_common.dynamo_batch import batch_get_items
+from birdtag_common.pagination import InvalidPageRequest
+
+SPECIES_INDEX_TABLE = os.environ.get('SPECIES_INDEX_TABLE', 'BirdSpeciesIndex')
+COUNT_INDEX_NAME = 'species-count-index'
+COUNT_KEY_WIDTH = 6
+# Most index items read per requirement when picking the driving species
+DRIVER_PROBE_LIMIT = int(os.environ.get('DRIVER_PROBE_LIMIT', '1000'))
+
+dynamodb = boto3.resource('dynamodb')
+index_table = dynamodb.Table(SPECIES_INDEX_TABLE)
+
+
+def count_key(count):
+    """Zero-pad a count so string order matches numeric order."""
+    return str(int(count)).zfill(COUNT_KEY_WIDTH)
+
+
+def build_index_items(record):
+    """Turn a BirdDetectionsResults record into its species index items."""
+    items = []
+    for species, count in (record.get('detections') or {}).items():
+        item = {
+            'species': species,
+            'fileID': record['fileID'],
+            'detectionCount': int(count),
+            'countKey': count_key(count),
+            'fileType': record.get('fileType', ''),
+            'originalURL': record.get('originalURL', '')
+        }
+        if record.get('thumbnailURL'):
+            item['thumbnailURL'] = record['thumbnailURL']
+        items.append(item)
+    return items
+
+
+def sync_species_index(record, previous_detections=None):
+    """
+    Write the index items for `record` and drop the ones for species that
+    were in `previous_detections` but are no longer detected.
+    """
+    sync_species_indexes([(record, previous_detections)])
+
+
+def sync_species_indexes(updates):
+    """Apply sync_species_index to many (record, previous_detections) pairs in one batch writer."""
+    with index_table.batch_writer(overwrite_by_pkeys=['species', 'fileID']) as batch:
+        for record, previous_detections in updates:
+            current = record.get('detections') or {}
+            for item in build_index_items(record):
+                batch.put_item(Item=item)
+            for species in (previous_detections or {}):
+                if species not in current:
+                    batch.delete_item(Key={'species': species, 'fileID': record['fileID']})
+
+
+def query_species_page(species, limit, start_key=None):
+    """
+    One page of index items for `species`.
+
+    Returns (items, last_key); last_key is None once the species is exhausted.
+    """
+    kwargs = {'KeyConditionExpression': Key('species').eq(species), 'Limit': limit}
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = index_table.query(**kwargs)
+    return response.get('Items', []), response.get('LastEvaluatedKey')
+
+
+def _min_count_condition(species, min_count):
+    return Key('species').eq(species) & Key('countKey').gte(count_key(min_count))
+
+
+def count_files_with_min_count(species, min_count, cap=None):
+    """
+    Number of files with at least `min_count` of `species`. With `cap`, stops
+    reading once that many are counted and returns `cap`.
+    """
+    kwargs = {
+        'IndexName': COUNT_INDEX_NAME,
+        'KeyConditionExpression': _min_count_condition(species, min_count),
+        'Select': 'COUNT'
+    }
+    total = 0
+    while True:
+        if cap is not None:
+            kwargs['Limit'] = cap - total
+        response = index_table.query(**kwargs)
+        total += response.get('Count', 0)
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key or (cap is not None and total >= cap):
+            return total
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def _pick_driver(tag_requirements):
+    """
+    The requirement with the fewest matching files, or None if one has none.
+    Each probe reads at most as many items as the smallest count so far
+    (DRIVER_PROBE_LIMIT to begin with), so a species that cannot win stops
+    early and common species are never counted in full.
+    """
+    driver, bound = None, DRIVER_PROBE_LIMIT
+    for species, min_count in tag_requirements.items():
+        size = count_files_with_min_count(species, min_count, cap=bound)
+        if size == 0:
+            return None
+        if driver is None or size < bound:
+            driver, bound = species, size
+    return driver
+
+
+def _meets_requirements(candidates, requirements):
+    """Keep the candidates whose index items satisfy every other requirement."""
+    keys = [
+        {'species': species, 'fileID': item['fileID']}
+        for item in candidates
+        for species in requirements
+    ]
+    satisfied = {
+        (entry['species'], entry['fileID'])
+        for entry in batch_get_items(index_table, keys, projection='species, fileID, detectionCount')
+        if entry['detectionCount'] >= requirements[entry['species']]
+    }
+    return [
+        item for item in candidates
+        if all((species, item['fileID']) in satisfied for species in requirements)
+    ]
+
+
+def find_files_with_counts(tag_requirements, limit, state=None):
+    """
+    One page of index items for files meeting every {species: min_count}
+    requirement.
+
+    The most selective requirement (found with bounded count probes) drives
+    a range query on the count index; each page of its fileIDs is
+    intersected with the other requirements by key lookups. Returns (items, state); pass `state` back in for the next
+    page, it is None when there are no more results. A `state` from a search
+    with other requirements raises InvalidPageRequest.
+    """
+    if state:
+        driver = state.get('driver')
+        if driver not in tag_requirements:
+            raise InvalidPageRequest('next_token does not belong to this search')
+        start_key = state.get('key')
+    else:
+        driver = _pick_driver(tag_requirements)
+        if driver is None:
+            return [], None
+        start_key = None
+
+    others = {species: count for species, count in tag_requirements.items() if species != driver}
+    items = []
+    while len(items) < limit:
+        kwargs = {
+            'IndexName': COUNT_INDEX_NAME,
+            'KeyConditionExpression': _min_count_condition(driver, tag_requirements[driver]),
+            'Limit': limit - len(items)
+        }
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = index_table.query(**kwargs)
+
+        candidates = response.get('Items', [])
+        if others and candidates:
+            candidates = _meets_requirements(candidates, others)
+        items.extend(candidates)
+
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            break
+
+    next_state = {'driver': driver, 'key': start_key} if start_key else None
+    return items, next_state
@@ -0,0 +1,284 @@
+"""
+Frame samplers for video detection.
+
+All modes yield (frame_index, frame) for frames spread evenly over a video:
+
+- "seek": cap.set(CAP_PROP_POS_FRAMES) before every sample. Each seek
+  decodes forward from the previous keyframe, which is expensive with
+  long-GOP H.264 and dense sampling.
+- "sequential": one pass over the stream, grab() to skip frames and
+  retrieve() only at sample points. Every frame is decoded once, no
+  colour conversion is done for skipped frames and nothing is decoded
+  twice.
+- "keyframe": a cheap demux-only pass (raw packets, no decoding) finds the
+  keyframes, then samples are taken only at keyframes, whose seeks decode a
+  single frame. Meant for very long recordings where exact positions do not
+  matter. The demux pass reads the whole stream, so over a URL it would
+  download the entire video; URLs are sampled in "seek" mode instead.
+
+The random-access modes (seek, keyframe) visit their positions coarse to
+fine (first, last, middle, quarters, ...), so a run that stops early has
+still looked across the whole timeline. "sequential" can only go forward.
+
+Use final_lambda_tag/benchmark_video_sampling.py to compare them on real
+footage.
+
+How many frames to sample, and which of them reach the model, is decided by
+infer_sampled_frames:
+
+- the sample count scales with the video's duration (VIDEO_SAMPLES_PER_SECOND,
+  clamped to VIDEO_MIN_SAMPLES..VIDEO_MAX_SAMPLES), so short clips are not
+  oversampled and long camera-trap recordings are not undersampled;
+- a sampled frame whose downscaled greyscale difference to the last inferred
+  frame is below VIDEO_MOTION_THRESHOLD is skipped, as it cannot change the
+  counts;
+- once something has been detected, sampling stops when the aggregate has
+  been stable for VIDEO_STABLE_SAMPLES sampled frames. Frames before the
+  first detection never count as stable, so a video whose birds only appear
+  late is not cut short and tagged empty.
+"""
+import os
+import cv2
+import numpy as np
+
+SAMPLER_MODES = ('seek', 'sequential', 'keyframe')
+DEFAULT_SAMPLER = os.environ.get('VIDEO_SAMPLER', 'seek')
+
+# Duration-aware sample count
+SAMPLES_PER_SECOND = float(os.environ.get('VIDEO_SAMPLES_PER_SECOND', '0.5'))
+MIN_SAMPLES = int(os.environ.get('VIDEO_MIN_SAMPLES', '3'))
+MAX_SAMPLES = int(os.environ.get('VIDEO_MAX_SAMPLES', '240'))
+
+# Mean absolute greyscale difference (0-255) below which a frame is skipped; 0 disables
+MOTION_THRESHOLD = float(os.environ.get('VIDEO_MOTION_THRESHOLD', '2.0'))
+MOTION_SIZE = (64, 36)
+
+# Stop after this many sampled frames without a change to the aggregate; 0 disables
+STABLE_SAMPLES = int(os.environ.get('VIDEO_STABLE_SAMPLES', '30'))
+
+
+class VideoOpenError(Exception):
+    """The video (a local path or a URL) could not be opened by OpenCV."""
+
+
+def sample_positions(frame_count, num_samples):
+    """Evenly spread frame indices, including the first and last frame."""
+    if frame_count <= 0:
+        return []
+    return sorted(set(np.linspace(0, frame_count - 1, num=num_samples, dtype=int).tolist()))
+
+
+def coarse_to_fine(positions):
+    """
+    `positions` reordered so every prefix is spread over the whole list:
+    first, last, middle, quarters, eighths, ... The fractions 0, 1, 1/2,
+    1/4, 3/4, 1/8, ... (bit-reversal order) are scaled to the list and
+    rounded, keeping the first occurrence of each index.
+    """
+    n = len(positions)
+    if n <= 2:
+        return list(positions)
+    bits = (n - 2).bit_length()
+    steps = 1 << bits
+    numerators = [0, steps] + [int(format(i, f'0{bits}b')[::-1], 2) for i in range(1, steps)]
+    order = []
+    seen = set()
+    for numerator in numerators:
+        # round(numerator / steps * (n - 1)), halves rounded up
+        index = (2 * numerator * (n - 1) + steps) // (2 * steps)
+        if index not in seen:
+            seen.add(index)
+            order.append(index)
+    # Steps are at most one position apart, so every index is reached; kept as a guard
+    order += [i for i in range(n) if i not in seen]
+    return [positions[i] for i in order]
+
+
+def adaptive_sample_count(frame_count, fps):
+    """Number of frames to sample for a video of `frame_count` frames at `fps`."""
+    if frame_count <= 0:
+        return 0
+    if fps <= 0:
+        # Unknown frame rate: assume 25 fps rather than giving up
+        fps = 25.0
+    wanted = int(round(frame_count / fps * SAMPLES_PER_SECOND))
+    return min(frame_count, max(MIN_SAMPLES, min(MAX_SAMPLES, wanted)))
+
+
+class MotionGate:
+    """Tells whether a frame differs enough from the last frame that passed."""
+
+    def __init__(self, threshold=None):
+        self.threshold = MOTION_THRESHOLD if threshold is None else threshold
+        self.reference = None
+
+    def changed(self, frame):
+        if self.threshold <= 0:
+            return True
+        small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+        if self.reference is not None and np.abs(grey - self.reference).mean() < self.threshold:
+            return False
+        self.reference = grey
+        return True
+
+
+def _seek_frames(cap, positions):
+    for idx in positions:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ret, frame = cap.read()
+        if ret:
+            yield idx, frame
+
+
+def _sequential_frames(cap, positions):
+    targets = set(positions)
+    last = positions[-1] if positions else -1
+    idx = positions[0] if positions else 0
+    if idx:
+        # A segment further into the video: one seek to its first sample
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+    while idx <= last:
+        if not cap.grab():
+            break
+        if idx in targets:
+            ret, frame = cap.retrieve()
+            if ret:
+                yield idx, frame
+        idx += 1
+
+
+def keyframe_positions(video_path, stop=None):
+    """Frame indices of the keyframes (before `stop`), read from packet flags without decoding."""
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    keyframes = []
+    try:
+        idx = 0
+        while cap.isOpened() and (stop is None or idx < stop) and cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) == 1:
+                keyframes.append(idx)
+            idx += 1
+    finally:
+        cap.release()
+    return keyframes
+
+
+def _open(video_path):
+    if '://' in video_path:
+        # Only FFmpeg reads URLs; other backends would echo the signed URL in errors
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    else:
+        cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        # Drop the query string so presigned credentials never reach the logs
+        raise VideoOpenError(f"Unable to open video file: {video_path.split('?')[0]}")
+    return cap
+
+
+def video_info(video_path):
+    """(frame_count, fps) of a video, from its container header."""
+    cap = _open(video_path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS)
+    finally:
+        cap.release()
+
+
+def sample_frames(video_path, num_samples=None, mode=None, frame_range=None):
+    """
+    Yield (frame_index, frame) for up to `num_samples` frames of the video,
+    or of the frames [start, end) when `frame_range` is given. Without
+    `num_samples` the count follows the duration of the video (or range).
+
+    `video_path` may also be an http(s) URL, e.g. a presigned S3 URL. FFmpeg
+    then reads it with range requests, so seek sampling only fetches the
+    container index and the GOPs around the sampled frames. Keyframe mode
+    is replaced by seek for URLs, as its demux pass reads every packet.
+    """
+    mode = mode or DEFAULT_SAMPLER
+    if mode not in SAMPLER_MODES:
+        raise ValueError(f"Unknown video sampler: {mode}")
+    if mode == 'keyframe' and '://' in video_path:
+        mode = 'seek'
+
+    cap = _open(video_path)
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        start, end = frame_range or (0, frame_count)
+        end = min(end, frame_count)
+        if num_samples is None:
+            num_samples = adaptive_sample_count(end - start, cap.get(cv2.CAP_PROP_FPS))
+
+        positions = None
+        if mode == 'keyframe':
+            keyframes = [k for k in keyframe_positions(video_path, stop=end) if k >= start]
+            if keyframes:
+                picks = sample_positions(len(keyframes), num_samples)
+                positions = [keyframes[i] for i in picks]
+            else:
+                # Backend without packet flags: fall back to exact positions
+                mode = 'seek'
+
+        if positions is None:
+            positions = [start + i for i in sample_positions(end - start, num_samples)]
+
+        if mode == 'sequential':
+            frames = _sequential_frames(cap, positions)
+        else:
+            frames = _seek_frames(cap, coarse_to_fine(positions))
+        decoded = 0
+        for sample in frames:
+            decoded += 1
+            yield sample
+
+        if positions and not decoded and '://' in video_path:
+            # Opened but unreadable, e.g. a server that ignores range requests
+            raise VideoOpenError(f"No frames could be read from {video_path.split('?')[0]}")
+    finally:
+        cap.release()
+
+
+def infer_sampled_frames(video_path, infer_batch, batch_size, mode=None, num_samples=None, frame_range=None):
+    """
+    Feed the sampled frames (of the whole video or of `frame_range`) that
+    survive the motion gate to `infer_batch` in batches of `batch_size`.
+    `infer_batch(frames)` folds the results into the caller's aggregate and
+    returns True if that changed it. Returns sampling stats for logging.
+    """
+    gate = MotionGate()
+    stats = {'sampled': 0, 'inferred': 0, 'stopped_early': False}
+    # Stability only counts once the aggregate is non-empty
+    detected = False
+    stable = 0
+    batch = []
+
+    frames = sample_frames(video_path, num_samples=num_samples, mode=mode, frame_range=frame_range)
+    try:
+        for _, frame in frames:
+            stats['sampled'] += 1
+            if gate.changed(frame):
+                batch.append(frame)
+            elif detected:
+                # A frame that looks like the last inferred one cannot change the counts
+                stable += 1
+
+            if len(batch) == batch_size:
+                stats['inferred'] += len(batch)
+                if infer_batch(batch):
+                    detected = True
+                    stable = 0
+                elif detected:
+                    stable += len(batch)
+                batch = []
+
+            if STABLE_SAMPLES and stable >= STABLE_SAMPLES:
+                stats['stopped_early'] = True
+                break
+    finally:
+        frames.close()
+
+    if batch:
+        stats['inferred'] += len(batch)
+        infer_batch(batch)
+
+    return stats
@@ -0,0 +1,153 @@
+"""
+Parallel segment fan-out for long videos.
+
+A long recording processed by one process_video call is sampled on one
+core inside one invocation's time limit. With VIDEO_SEGMENTS > 1, videos of
+at least VIDEO_SEGMENT_MIN_SECONDS are split into that many contiguous frame
+ranges that are processed in parallel, and the per-species max counts of the
+segments are merged into one result:
+
+- "process" (default outside Lambda): a local process pool, one worker per
+  segment up to the available cores;
+- "lambda" (default inside Lambda, where process pools are unavailable):
+  one synchronous sub-invocation of the same function per segment.
+
+Every finished segment is checkpointed in BirdVideoSegments under a job key
+of model version, source ETag and segment count. When an invocation times
+out and the event is retried, the segments already checkpointed are read
+back and only the unfinished ones run again. Sub-invocations write their own
+checkpoint, so their work survives even if the parent times out first.
+Checkpoints expire after VIDEO_SEGMENT_TTL_SECONDS.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from decimal import Decimal
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+
+from birdtag_common.content_index import MODEL_VERSION
+from birdtag_common.runtime_profile import visible_cores
+
+VIDEO_SEGMENTS = int(os.environ.get('VIDEO_SEGMENTS', '0'))
+VIDEO_SEGMENT_MIN_SECONDS = float(os.environ.get('VIDEO_SEGMENT_MIN_SECONDS', '300'))
+VIDEO_FANOUT = os.environ.get(
+    'VIDEO_FANOUT', 'lambda' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'process'
+)
+SEGMENT_TABLE = os.environ.get('VIDEO_SEGMENT_TABLE', 'BirdVideoSegments')
+SEGMENT_TTL_SECONDS = int(os.environ.get('VIDEO_SEGMENT_TTL_SECONDS', str(7 * 24 * 3600)))
+
+dynamodb = boto3.resource('dynamodb')
+segment_table = dynamodb.Table(SEGMENT_TABLE)
+# Sub-invocations run for minutes; a retried invoke would only duplicate a segment
+lambda_client = boto3.client('lambda', config=Config(
+    read_timeout=900, retries={'total_max_attempts': 1}, max_pool_connections=max(10, VIDEO_SEGMENTS)
+))
+
+
+def segment_count(frame_count, fps):
+    """Number of segments for a video, 1 when it is too short to split."""
+    if VIDEO_SEGMENTS <= 1 or frame_count <= 0:
+        return 1
+    duration = frame_count / (fps if fps > 0 else 25.0)
+    if duration < VIDEO_SEGMENT_MIN_SECONDS:
+        return 1
+    return min(VIDEO_SEGMENTS, frame_count)
+
+
+def segment_ranges(frame_count, segments):
+    """Contiguous [start, end) frame ranges covering the video."""
+    bounds = [frame_count * i // segments for i in range(segments + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(segments)]
+
+
+def job_key(etag, segments):
+    """Checkpoint key of one video's segmented run."""
+    return f"{MODEL_VERSION}#{etag}#{segments}"
+
+
+def load_checkpoints(job):
+    """{segment index: detections} of the segments of `job` that already finished."""
+    done = {}
+    kwargs = {'KeyConditionExpression': Key('jobKey').eq(job), 'ConsistentRead': True}
+    while True:
+        response = segment_table.query(**kwargs)
+        for item in response['Items']:
+            done[int(item['segment'])] = {bird: int(count) for bird, count in item['detections'].items()}
+        if 'LastEvaluatedKey' not in response:
+            return done
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def save_checkpoint(job, index, detections):
+    """Record one finished segment."""
+    segment_table.put_item(Item={
+        'jobKey': job,
+        'segment': index,
+        'detections': detections,
+        'expiresAt': Decimal(int(time.time()) + SEGMENT_TTL_SECONDS)
+    })
+
+
+def merge_segments(parts):
+    """Per-species maximum over the segments' counts."""
+    merged = {}
+    for detections in parts:
+        for bird, count in detections.items():
+            merged[bird] = max(count, merged.get(bird, 0))
+    return merged
+
+
+def invoke_segment(payload):
+    """Run one segment in a synchronous sub-invocation of this function; returns its detections."""
+    response = lambda_client.invoke(
+        FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+        Payload=json.dumps({'segment': payload}).encode()
+    )
+    result = json.loads(response['Payload'].read() or b'null')
+    if response.get('FunctionError') or not isinstance(result, dict) or result.get('statusCode') != 200:
+        raise RuntimeError(f"Segment {payload['index']} failed: {result}")
+    if 'detections' not in result:
+        # The handler the function is deployed with did not route the 'segment' event
+        raise RuntimeError(f"Segment {payload['index']} returned no detections: {result}")
+    return result['detections']
+
+
+def fan_out(job, ranges, process_range, segment_payload):
+    """
+    Detections of a video split into `ranges`. Checkpointed segments are read
+    back; the rest run in parallel, either as `process_range(frame_range)` in
+    a process pool (it must be picklable) or as sub-invocations with
+    `segment_payload(index, frame_range)` as their 'segment' event. Raises
+    after all segments have run if any of them failed, so a retry repeats
+    only those.
+    """
+    done = load_checkpoints(job)
+    pending = [(i, frame_range) for i, frame_range in enumerate(ranges) if i not in done]
+    print(f"Video segments: {len(ranges)} total, {len(done)} checkpointed, {len(pending)} to run")
+
+    errors = []
+    if pending and VIDEO_FANOUT == 'lambda':
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            futures = {pool.submit(invoke_segment, segment_payload(i, r)): i for i, r in pending}
+            for future in as_completed(futures):
+                try:
+                    # The sub-invocation has checkpointed its segment already
+                    done[futures[future]] = future.result()
+                except Exception as e:
+                    errors.append(str(e))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=min(len(pending), visible_cores())) as pool:
+            futures = {pool.submit(process_range, r): i for i, r in pending}
+            for future in as_completed(futures):
+                try:
+                    done[futures[future]] = future.result()
+                    save_checkpoint(job, futures[future], done[futures[future]])
+                except Exception as e:
+                    errors.append(f"Segment {futures[future]} failed: {e}")
+
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    return merge_segments(done[i] for i in range(len(ranges)))
@@ -0,0 +1,174 @@
+"""
+Warm in-container detection index.
+
+The query Lambda keeps a compact copy of every file's detections in module
+globals, so repeated species and tag searches are answered from memory. On
+cold start the index is loaded from the snapshot in S3 (written by
+lambda/catalog_index/snapshot_handler.py), or built from the table if there
+is none. Each search then compares the catalog version with the index's and
+replays only the newer changes from the change log.
+"""
+import bisect
+import gzip
+import json
+import os
+import time
+import boto3
+
+from birdtag_common.catalog_version import (
+    current_version, version_state, changes_since, GAP_TIMEOUT_SECONDS
+)
+from birdtag_common.dynamo_scan import parallel_scan
+
+SNAPSHOT_BUCKET = os.environ.get('SNAPSHOT_BUCKET', 'g146-a3')
+SNAPSHOT_KEY = os.environ.get('WARM_INDEX_SNAPSHOT_KEY', 'catalog/detections-snapshot.json.gz')
+# Seconds between version checks; 0 checks on every search
+REFRESH_INTERVAL = float(os.environ.get('WARM_INDEX_REFRESH_SECONDS', '0'))
+# Beyond this many pending changes a reload is cheaper than a replay
+MAX_REPLAY = 20000
+
+s3 = boto3.client('s3')
+dynamodb = boto3.resource('dynamodb')
+table = dynamodb.Table('BirdDetectionsResults')
+
+
+def compact_record(item):
+    """The fields of a detection record that searches need, with plain ints."""
+    return {
+        'fileID': item['fileID'],
+        'fileType': item.get('fileType', ''),
+        'originalURL': item.get('originalURL', ''),
+        'thumbnailURL': item.get('thumbnailURL') or '',
+        'detections': {species: int(count) for species, count in (item.get('detections') or {}).items()}
+    }
+
+
+class DetectionIndex:
+    """fileID -> record, plus species -> {fileID: count} for lookups."""
+
+    def __init__(self, version, items):
+        self.version = version
+        self.files = {}
+        self.species = {}
+        self._sorted_ids = {}
+        for item in items:
+            self._put(item)
+
+    def _put(self, item):
+        self._remove(item['fileID'])
+        record = compact_record(item)
+        self.files[record['fileID']] = record
+        for species, count in record['detections'].items():
+            self.species.setdefault(species, {})[record['fileID']] = count
+            self._sorted_ids.pop(species, None)
+
+    def _remove(self, file_id):
+        record = self.files.pop(file_id, None)
+        if record:
+            for species in record['detections']:
+                self.species[species].pop(file_id, None)
+                self._sorted_ids.pop(species, None)
+
+    def apply(self, change):
+        """Apply one change-log entry (a full record, or a deletion marker)."""
+        if change.get('deleted'):
+            self._remove(change['fileID'])
+        else:
+            self._put(change)
+        self.version = int(change['seq'])
+
+    def _file_ids(self, species):
+        # Sorted lazily and only re-sorted after the species changes
+        file_ids = self._sorted_ids.get(species)
+        if file_ids is None:
+            file_ids = self._sorted_ids[species] = sorted(self.species.get(species, {}))
+        return file_ids
+
+    def find_files(self, requirements, limit, after=None):
+        """
+        One page of records meeting every {species: min_count} requirement,
+        ordered by fileID and starting after fileID `after`.
+        Returns (records, last fileID if there may be more, else None).
+        """
+        if not requirements or any(species not in self.species for species in requirements):
+            return [], None
+
+        driver = min(requirements, key=lambda species: len(self.species[species]))
+        file_ids = self._file_ids(driver)
+        start = bisect.bisect_right(file_ids, after) if after else 0
+
+        records = []
+        for position in range(start, len(file_ids)):
+            record = self.files[file_ids[position]]
+            detections = record['detections']
+            if all(detections.get(species, 0) >= count for species, count in requirements.items()):
+                records.append(record)
+                if len(records) == limit:
+                    has_more = position + 1 < len(file_ids)
+                    return records, (record['fileID'] if has_more else None)
+        return records, None
+
+
+def build_from_table():
+    """Full parallel scan; the version is read first so racing writes get replayed."""
+    version = current_version()
+    items = parallel_scan(table, projection='fileID, fileType, originalURL, thumbnailURL, detections')
+    return DetectionIndex(version, items)
+
+
+def load_snapshot():
+    """Index from the S3 snapshot, or None if no snapshot has been written yet."""
+    try:
+        response = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_KEY)
+    except s3.exceptions.NoSuchKey:
+        return None
+    snapshot = json.loads(gzip.decompress(response['Body'].read()))
+    return DetectionIndex(snapshot['version'], snapshot['items'])
+
+
+def write_snapshot():
+    """Rebuild the index from the table and store it as the S3 snapshot."""
+    index = build_from_table()
+    snapshot = {'version': index.version, 'items': list(index.files.values())}
+    s3.put_object(
+        Bucket=SNAPSHOT_BUCKET,
+        Key=SNAPSHOT_KEY,
+        Body=gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode()),
+        ContentType='application/json',
+        ContentEncoding='gzip'
+    )
+    return index
+
+
+def refresh(index):
+    """Bring `index` up to the catalog version; returns the index to use."""
+    latest, updated_at = version_state()
+    if latest - index.version > MAX_REPLAY:
+        print(f"Warm index is {latest - index.version} changes behind, reloading")
+        return load_snapshot() or build_from_table()
+
+    if latest > index.version:
+        for change in changes_since(index.version):
+            index.apply(change)
+        if index.version < latest and time.time() - updated_at > GAP_TIMEOUT_SECONDS:
+            # The newest numbers were reserved by a write that failed and was re-logged
+            print(f"Skipping catalog changes {index.version + 1}-{latest}, never written")
+            index.version = latest
+    return index
+
+
+_index = None
+_checked_at = 0.0
+
+
+def get_warm_index():
+    """The container's index, loaded on first use and refreshed from the change log."""
+    global _index, _checked_at
+    if _index is None:
+        _index = load_snapshot() or build_from_table()
+
+    now = time.monotonic()
+    if now - _checked_at >= REFRESH_INTERVAL:
+        _index = refresh(_index)
+        _checked_at = now
+    return _index
@@ -0,0 +1,21 @@
+from birdtag_common.warm_index import write_snapshot, SNAPSHOT_BUCKET, SNAPSHOT_KEY
+from birdtag_common.detection_matrix import write_matrix_snapshot, MATRIX_PREFIX
+
+def lambda_handler(event, context):
+    """
+    Scheduled (e.g. hourly EventBridge rule). Writes the detection snapshot
+    that warm query containers load on cold start, and the columnar
+    detection matrix used for vectorized tag-count queries.
+    """
+    index = write_snapshot()
+    manifest = write_matrix_snapshot(index.files.values(), index.version)
+    print(f"Wrote snapshot of {len(index.files)} files "
+          f"({len(manifest['species'])} species) at version {index.version}")
+
+    return {
+        'statusCode': 200,
+        'snapshot': f"s3://{SNAPSHOT_BUCKET}/{SNAPSHOT_KEY}",
+        'matrix': f"s3://{SNAPSHOT_BUCKET}/{MATRIX_PREFIX}",
+        'files': len(index.files),
+        'version': index.version
+    }
@@ -0,0 +1,34 @@
+from boto3.dynamodb.types import TypeDeserializer
+from birdtag_common.catalog_version import record_changes
+from birdtag_common.warm_index import compact_record
+
+deserializer = TypeDeserializer()
+
+def lambda_handler(event, context):
+    """
+    Triggered by the DynamoDB Stream of BirdDetectionsResults (NEW_IMAGE or
+    NEW_AND_OLD_IMAGES). Logs each write as a catalog change and bumps the
+    catalog version, which tells warm query containers to refresh.
+    """
+    changes = []
+    for record in event.get('Records', []):
+        stream_record = record['dynamodb']
+        file_id = stream_record['Keys']['fileID']['S']
+
+        if record['eventName'] == 'REMOVE':
+            changes.append({'fileID': file_id, 'deleted': True})
+        else:
+            image = {
+                name: deserializer.deserialize(value)
+                for name, value in stream_record['NewImage'].items()
+            }
+            changes.append(compact_record(image))
+
+    version = record_changes(changes)
+    print(f"Logged {len(changes)} catalog changes, version is now {version}")
+
+    return {
+        'statusCode': 200,
+        'changes': len(changes),
+        'version': version
+    }
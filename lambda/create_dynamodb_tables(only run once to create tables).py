@@ -0,0 +1,150 @@
+# create_dynamodb_tables.py
+import boto3
+from birdtag_common.species_index import (
+    SPECIES_INDEX_TABLE, COUNT_INDEX_NAME, sync_species_indexes
+)
+from birdtag_common.dynamo_scan import parallel_scan
+from birdtag_common.catalog_version import CATALOG_CHANGES_TABLE
+from birdtag_common.result_cache import RESULT_CACHE_TABLE
+from birdtag_common.content_index import CONTENT_INDEX_TABLE
+from birdtag_common.video_segments import SEGMENT_TABLE
+
+dynamodb = boto3.resource('dynamodb')
+client = boto3.client('dynamodb')
+
+# Index tables that sit next to BirdDetectionsResults
+tables = [
+    {
+        'TableName': SPECIES_INDEX_TABLE,
+        'KeySchema': [
+            {'AttributeName': 'species', 'KeyType': 'HASH'},
+            {'AttributeName': 'fileID', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'species', 'AttributeType': 'S'},
+            {'AttributeName': 'fileID', 'AttributeType': 'S'},
+            {'AttributeName': 'countKey', 'AttributeType': 'S'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': COUNT_INDEX_NAME,
+                'KeySchema': [
+                    {'AttributeName': 'species', 'KeyType': 'HASH'},
+                    {'AttributeName': 'countKey', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            }
+        ],
+        'BillingMode': 'PAY_PER_REQUEST'
+    },
+    {
+        # Catalog version item plus the change log replayed by warm query containers
+        'TableName': CATALOG_CHANGES_TABLE,
+        'KeySchema': [
+            {'AttributeName': 'stream', 'KeyType': 'HASH'},
+            {'AttributeName': 'seq', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'stream', 'AttributeType': 'S'},
+            {'AttributeName': 'seq', 'AttributeType': 'N'}
+        ],
+        'BillingMode': 'PAY_PER_REQUEST'
+    },
+    {
+        # Shared tier of the search result cache (RESULT_CACHE_SHARED=dynamodb)
+        'TableName': RESULT_CACHE_TABLE,
+        'KeySchema': [
+            {'AttributeName': 'cacheKey', 'KeyType': 'HASH'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'cacheKey', 'AttributeType': 'S'}
+        ],
+        'BillingMode': 'PAY_PER_REQUEST'
+    },
+    {
+        # Content hash -> detections, so re-uploads of the same file skip inference
+        'TableName': CONTENT_INDEX_TABLE,
+        'KeySchema': [
+            {'AttributeName': 'contentKey', 'KeyType': 'HASH'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'contentKey', 'AttributeType': 'S'}
+        ],
+        'BillingMode': 'PAY_PER_REQUEST'
+    },
+    {
+        # Per-segment checkpoints of long videos processed in parallel (VIDEO_SEGMENTS)
+        'TableName': SEGMENT_TABLE,
+        'KeySchema': [
+            {'AttributeName': 'jobKey', 'KeyType': 'HASH'},
+            {'AttributeName': 'segment', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'jobKey', 'AttributeType': 'S'},
+            {'AttributeName': 'segment', 'AttributeType': 'N'}
+        ],
+        'BillingMode': 'PAY_PER_REQUEST'
+    }
+]
+
+# Attribute used by DynamoDB TTL to expire old rows, per table
+ttl_attributes = {CATALOG_CHANGES_TABLE: 'expiresAt', RESULT_CACHE_TABLE: 'expiresAt', SEGMENT_TABLE: 'expiresAt'}
+
+for definition in tables:
+    try:
+        client.create_table(**definition)
+        client.get_waiter('table_exists').wait(TableName=definition['TableName'])
+        print(f"Created table: {definition['TableName']}")
+    except client.exceptions.ResourceInUseException:
+        print(f"Table already exists: {definition['TableName']}")
+        # Add any secondary index that was introduced after the table was created
+        existing = client.describe_table(TableName=definition['TableName'])['Table']
+        existing_indexes = {i['IndexName'] for i in existing.get('GlobalSecondaryIndexes', [])}
+        for index in definition.get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] not in existing_indexes:
+                client.update_table(
+                    TableName=definition['TableName'],
+                    AttributeDefinitions=definition['AttributeDefinitions'],
+                    GlobalSecondaryIndexUpdates=[{'Create': index}]
+                )
+                print(f"Added index {index['IndexName']} to {definition['TableName']}")
+    except Exception as e:
+        print(f"Error creating table {definition['TableName']}: {e}")
+
+for table_name, attribute in ttl_attributes.items():
+    try:
+        client.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': attribute}
+        )
+        print(f"Enabled TTL on {table_name}.{attribute}")
+    except Exception as e:
+        print(f"TTL on {table_name}: {e}")
+
+# The catalog stream handler is fed by the detections table's stream
+try:
+    client.update_table(
+        TableName='BirdDetectionsResults',
+        StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+    )
+    print("Enabled stream on BirdDetectionsResults")
+except Exception as e:
+    print(f"Stream on BirdDetectionsResults: {e}")
+
+# Backfill the species index (and its count keys) from the existing detections
+# in chunks, so the index items go out 25 per BatchWriteItem across files
+BACKFILL_CHUNK = 1000
+table = dynamodb.Table('BirdDetectionsResults')
+indexed = 0
+chunk = []
+for item in parallel_scan(table):
+    chunk.append((item, None))
+    if len(chunk) == BACKFILL_CHUNK:
+        sync_species_indexes(chunk)
+        indexed += len(chunk)
+        chunk = []
+if chunk:
+    sync_species_indexes(chunk)
+    indexed += len(chunk)
+
+print(f"Indexed {indexed} files into {SPECIES_INDEX_TABLE}")
@@ -3,39 +3,32 @@ import json
 import boto3
 import base64
 import os
-import shutil
-import cv2
-import numpy as np
-from decimal import Decimal
+from birdtag_common.species_index import find_files_with_counts
+from birdtag_common.detection_matrix import get_detection_matrix
+from birdtag_common.detection_counts import species_present
+from birdtag_common.image_decoding import decode_image, MODEL_IMGSZ
+from birdtag_common.inference import load_model
+from birdtag_common.video_sampling import infer_sampled_frames
+from birdtag_common.pagination import (
+    InvalidPageRequest, encode_token, decode_token, parse_limit, json_default
+)
 
 # Model setup (EXACTLY same as your tagging function)
-MODEL_SRC_PATH = '/var/task/model.pt'
-MODEL_DST_PATH = '/tmp/model.pt'
+model = load_model()
 
-if not os.path.exists(MODEL_DST_PATH):
-    shutil.copyfile(MODEL_SRC_PATH, MODEL_DST_PATH)
-
-# Set torch to use weights_only=False for YOLO models
-import torch
-original_load = torch.load
-def patched_load(*args, **kwargs):
-    if 'weights_only' not in kwargs:
-        kwargs['weights_only'] = False
-    return original_load(*args, **kwargs)
-torch.load = patched_load
-
-from ultralytics import YOLO
-model = YOLO(MODEL_DST_PATH)
+# Sampled video frames sent through the model per forward pass
+VIDEO_BATCH_SIZE = int(os.environ.get('VIDEO_BATCH_SIZE', '10'))
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table('BirdDetectionsResults')
 
+# Match against the S3 detection-matrix snapshot instead of the species index
+DETECTION_MATRIX_ENABLED = os.environ.get('DETECTION_MATRIX', '0') == '1'
+
 class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, Decimal):
-            return int(o) if o % 1 == 0 else float(o)
-        return super(DecimalEncoder, self).default(o)
+        return json_default(o)
 
 def detect_birds_in_file(file_content, file_extension):
     """
@@ -51,18 +44,17 @@ def detect_birds_in_file(file_content, file_extension):
 
 def detect_birds_in_image(image_bytes):
     """Process image bytes and return detected bird species."""
-    np_arr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    
-    results = model(img)[0]
-    detected_species = set()
+    img = decode_image(image_bytes)
     
-    for box in results.boxes:
-        if box.conf > 0.5:  # Confidence threshold
-            class_id = int(box.cls)
-            class_name = model.names[class_id]
-            detected_species.add(class_name)
+    results = model(img, imgsz=MODEL_IMGSZ)[0]
     
+    return species_present(results.boxes, model.names)
+
+def species_in_frames(frames):
+    """Run one batch of frames through the model and return the species seen in any of them."""
+    detected_species = set()
+    for results in model(frames):
+        detected_species |= species_present(results.boxes, model.names)
     return detected_species
 
 def detect_birds_in_video(video_bytes):
@@ -73,61 +65,37 @@ def detect_birds_in_video(video_bytes):
         f.write(video_bytes)
     
     detected_species = set()
-    cap = cv2.VideoCapture(temp_video_path)
-    
-    if not cap.isOpened():
-        raise Exception("Unable to open video file")
+
+    def add_species(frames):
+        new_species = species_in_frames(frames) - detected_species
+        detected_species.update(new_species)
+        return bool(new_species)
     
     try:
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if frame_count == 0:
-            return detected_species
-        
-        # Sample 10 frames evenly distributed
-        sample_indices = np.linspace(0, frame_count - 1, num=10, dtype=int)
-        
-        for idx in sample_indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-            ret, frame = cap.read()
-            if not ret:
-                continue
-            
-            results = model(frame)[0]
-            for box in results.boxes:
-                if box.conf > 0.5:  # Confidence threshold
-                    class_id = int(box.cls)
-                    class_name = model.names[class_id]
-                    detected_species.add(class_name)
+        stats = infer_sampled_frames(temp_video_path, add_species, VIDEO_BATCH_SIZE)
+        print(f"Video sampling: {stats}")
     
     finally:
-        cap.release()
         # Clean up temp file
         if os.path.exists(temp_video_path):
             os.remove(temp_video_path)
     
     return detected_species
 
-def find_matching_files(detected_species):
+def find_matching_files(detected_species, limit, state=None):
     """
-    Find all files in DynamoDB that contain ALL the detected species.
+    Find one page of files in DynamoDB that contain ALL the detected species.
+    Returns (items, state for the next page or None).
     """
     if not detected_species:
-        return []
-    
-    # Scan all items in DynamoDB
-    response = table.scan()
-    all_items = response.get('Items', [])
-    matching_items = []
-    
-    for item in all_items:
-        detections = item.get('detections', {})
-        item_species = set(detections.keys())
-        
-        # Check if all detected species are present in this item
-        if detected_species.issubset(item_species):
-            matching_items.append(item)
+        return [], None
     
-    return matching_items
+    # "Contains the species" is "at least one of it"
+    requirements = {species: 1 for species in detected_species}
+    if DETECTION_MATRIX_ENABLED:
+        matching_items, last_id = get_detection_matrix().find_files(requirements, limit, state and state.get('after'))
+        return matching_items, ({'after': last_id} if last_id else None)
+    return find_files_with_counts(requirements, limit, state)
 
 def process_results(items):
     """
@@ -171,39 +139,49 @@ def lambda_handler(event, context):
                 }
             }
         
-        # Parse the request body
-        body = event.get('body', '')
-        if event.get('isBase64Encoded', False):
-            body = base64.b64decode(body)
-        
-        # Extract file content and metadata
-        # Assuming multipart/form-data or direct file upload
-        # You might need to adjust this based on your frontend implementation
-        
-        # For now, assuming the body contains the raw file data
-        # and filename is passed as a query parameter
         params = event.get('queryStringParameters', {}) or {}
-        filename = params.get('filename', 'uploaded_file')
-        file_extension = filename.split('.')[-1] if '.' in filename else ''
-        
-        if not file_extension:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'File extension not provided'}),
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                }
-            }
+        limit = parse_limit(params.get('limit'))
+        state = decode_token(params.get('next_token'))
         
-        # Convert body to bytes if it's a string
-        if isinstance(body, str):
-            file_content = body.encode()
+        if state:
+            # Later pages reuse the species detected for the first page, no re-upload needed
+            species = state.get('species')
+            if not isinstance(species, list) or not all(isinstance(name, str) for name in species):
+                raise InvalidPageRequest('next_token does not belong to this search')
+            detected_species = set(species)
         else:
-            file_content = body
-        
-        # Detect birds in the uploaded file
-        detected_species = detect_birds_in_file(file_content, file_extension)
+            # Parse the request body
+            body = event.get('body', '')
+            if event.get('isBase64Encoded', False):
+                body = base64.b64decode(body)
+
+            # Extract file content and metadata
+            # Assuming multipart/form-data or direct file upload
+            # You might need to adjust this based on your frontend implementation
+
+            # For now, assuming the body contains the raw file data
+            # and filename is passed as a query parameter
+            filename = params.get('filename', 'uploaded_file')
+            file_extension = filename.split('.')[-1] if '.' in filename else ''
+
+            if not file_extension:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'File extension not provided'}),
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    }
+                }
+
+            # Convert body to bytes if it's a string
+            if isinstance(body, str):
+                file_content = body.encode()
+            else:
+                file_content = body
+
+            # Detect birds in the uploaded file
+            detected_species = detect_birds_in_file(file_content, file_extension)
         
         if not detected_species:
             return {
@@ -211,6 +189,7 @@ def lambda_handler(event, context):
                 'body': json.dumps({
                     'detected_species': [],
                     'matching_files': [],
+                    'next_token': None,
                     'message': 'No birds detected in the uploaded file'
                 }),
                 'headers': {
@@ -220,15 +199,18 @@ def lambda_handler(event, context):
             }
         
         # Find matching files in DynamoDB
-        matching_items = find_matching_files(detected_species)
+        matching_items, next_state = find_matching_files(detected_species, limit, state)
         result_links = process_results(matching_items)
+        if next_state:
+            next_state['species'] = sorted(detected_species)
         
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'detected_species': list(detected_species),
                 'matching_files': result_links,
-                'total_matches': len(result_links)
+                'total_matches': len(result_links),
+                'next_token': encode_token(next_state)
             }, cls=DecimalEncoder),
             'headers': {
                 'Content-Type': 'application/json',
@@ -236,6 +218,15 @@ def lambda_handler(event, context):
             }
         }
     
+    except InvalidPageRequest as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)}),
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            }
+        }
     except Exception as e:
         print(f"Error in file-based search: {str(e)}")
         return {
@@ -1,22 +1,46 @@
 import json
 import os
+import time
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-from decimal import Decimal
+from birdtag_common.species_index import (
+    sync_species_indexes, query_species_page, find_files_with_counts
+)
+from birdtag_common.pagination import (
+    InvalidPageRequest, encode_token, decode_token, parse_limit, json_default
+)
+from birdtag_common.warm_index import get_warm_index
+from birdtag_common.result_cache import cached_search
+from birdtag_common.deletion import delete_files
+from birdtag_common.detection_records import EDITED_AT
 
 # Custom JSON encoder to handle Decimal types
 class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, Decimal):
-            return int(o) if o % 1 == 0 else float(o)
-        return super(DecimalEncoder, self).default(o)
+        return json_default(o)
 
 # Initialize AWS services
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table('BirdDetectionsResults')
 s3 = boto3.client('s3')
 
+# Answer species/tag searches from the in-container warm index instead of DynamoDB
+WARM_INDEX_ENABLED = os.environ.get('WARM_INDEX', '0') == '1'
+
+# Answer tag searches with vectorized masks over the S3 detection-matrix snapshot
+DETECTION_MATRIX_ENABLED = os.environ.get('DETECTION_MATRIX', '0') == '1'
+if DETECTION_MATRIX_ENABLED:
+    # numpy is only needed in the deployment package when this is switched on
+    from birdtag_common.detection_matrix import get_detection_matrix
+
+# Cache search responses per canonical query and catalog version (see birdtag_common.result_cache)
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE', '0') == '1'
+
+# Concurrent per-file writes for bulk tag updates
+TAG_UPDATE_WORKERS = int(os.environ.get('TAG_UPDATE_WORKERS', '16'))
+
 def lambda_handler(event, context):
     http_method = event['httpMethod']
     path = event['path']
@@ -63,7 +87,7 @@ def handle_tag_search(event):
     if not tag_requirements:
         return {
             'statusCode': 200, 
-            'body': json.dumps({'links': []}),
+            'body': json.dumps({'links': [], 'next_token': None}),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
@@ -71,45 +95,34 @@ def handle_tag_search(event):
         }
     
     try:
-        response = table.scan()
-        all_items = response.get('Items', [])
-        matching_items = []
-        
-        for item in all_items:
-            matches_all_requirements = True
-            
-            # Check if detections object exists
-            detections = item.get('detections', {})
-            
-            # Check each tag requirement
-            for required_tag, required_count in tag_requirements.items():
-                if required_tag not in detections:
-                    matches_all_requirements = False
-                    break
-                
-                # Get the actual count
-                actual_count = detections[required_tag]
-                if isinstance(actual_count, Decimal):
-                    actual_count = int(actual_count)
-                
-                if actual_count < required_count:
-                    matches_all_requirements = False
-                    break
-            
-            if matches_all_requirements:
-                matching_items.append(item)
+        limit = parse_limit(params.get('limit'))
+        next_token = params.get('next_token')
+        state = decode_token(next_token)
         
-        links = process_results(matching_items)
+        if RESULT_CACHE_ENABLED:
+            result = cached_search('tag', tag_requirements, limit, next_token,
+                                   lambda: tag_search_page(tag_requirements, limit, state))
+        else:
+            result = tag_search_page(tag_requirements, limit, state)
         
         return {
             'statusCode': 200, 
-            'body': json.dumps({'links': links}, cls=DecimalEncoder),
+            'body': json.dumps(result, cls=DecimalEncoder),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             }
         }
         
+    except InvalidPageRequest as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)}),
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            }
+        }
     except Exception as e:
         print(f"Error in handle_tag_search: {str(e)}")
         return {
@@ -127,25 +140,34 @@ def handle_species_search(event):
     species = params.get('species', '').capitalize()
 
     try:
-        response = table.scan()
-        matching_items = []
-        
-        for item in response.get('Items', []):
-            detections = item.get('detections', {})
-            if species in detections:
-                matching_items.append(item)
+        limit = parse_limit(params.get('limit'))
+        next_token = params.get('next_token')
+        state = decode_token(next_token)
 
-        result = process_results(matching_items)
+        if RESULT_CACHE_ENABLED:
+            result = cached_search('species', {species: 1}, limit, next_token,
+                                   lambda: species_search_page(species, limit, state))
+        else:
+            result = species_search_page(species, limit, state)
 
         return {
             'statusCode': 200,
-            'body': json.dumps({'links': result}, cls=DecimalEncoder),
+            'body': json.dumps(result, cls=DecimalEncoder),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             }
         }
         
+    except InvalidPageRequest as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)}),
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            }
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -157,6 +179,34 @@ def handle_species_search(event):
         }
 
 
+def tag_search_page(tag_requirements, limit, state):
+    """One page of links for files meeting every {species: min_count} requirement."""
+    if DETECTION_MATRIX_ENABLED:
+        matching_items, last_id = get_detection_matrix().find_files(tag_requirements, limit, state and state.get('after'))
+        next_state = {'after': last_id} if last_id else None
+    elif WARM_INDEX_ENABLED:
+        matching_items, last_id = get_warm_index().find_files(tag_requirements, limit, state and state.get('after'))
+        next_state = {'after': last_id} if last_id else None
+    else:
+        # Range query per species on the count index, intersected by fileID
+        matching_items, next_state = find_files_with_counts(tag_requirements, limit, state)
+    
+    return {'links': process_results(matching_items), 'next_token': encode_token(next_state)}
+
+
+def species_search_page(species, limit, state):
+    """One page of links for files containing `species`."""
+    if WARM_INDEX_ENABLED:
+        matching_items, last_id = get_warm_index().find_files({species: 1}, limit, state and state.get('after'))
+        next_state = {'after': last_id} if last_id else None
+    else:
+        # Species index items carry fileType and URLs, so no table lookup is needed
+        matching_items, last_key = query_species_page(species, limit, state and state.get('key'))
+        next_state = {'key': last_key} if last_key else None
+    
+    return {'links': process_results(matching_items), 'next_token': encode_token(next_state)}
+
+
 def handle_thumbnail_search(event):
     """
     Find files based on the thumbnail's URL.
@@ -193,15 +243,10 @@ def handle_thumbnail_search(event):
                 }
             }
         
-        # Query DynamoDB for the original file
-        response = table.scan()
-        matching_items = []
-        
-        for item in response.get('Items', []):
-            if item.get('fileID') == file_id:
-                matching_items.append(item)
+        # fileID is the primary key, so this is a single point lookup
+        original_item = table.get_item(Key={'fileID': file_id}).get('Item')
         
-        if not matching_items:
+        if not original_item:
             return {
                 'statusCode': 404,
                 'body': json.dumps({'error': 'Original file not found'}),
@@ -212,7 +257,6 @@ def handle_thumbnail_search(event):
             }
         
         # Return the full-size image URL
-        original_item = matching_items[0]
         full_size_url = original_item.get('originalURL', '')
         
         return {
@@ -274,53 +318,42 @@ def handle_bulk_tags(event):
             count = int(parts[1].strip())
             tag_dict[species] = count
     
-    # Process each URL
-    updated_files = []
+    # Resolve every URL to its file ID
+    file_ids = []
     for url in urls:
         # Extract file ID from URL
         if 's3://g146-a3/thumbnails/' in url:
             thumbnail_file = url.replace('s3://g146-a3/thumbnails/', '')
-            file_id = f"images/{thumbnail_file}"
+            file_ids.append(f"images/{thumbnail_file}")
         elif 's3://g146-a3/' in url:
-            file_id = url.replace('s3://g146-a3/', '')
-        else:
-            continue
-        
-        # Get current item from DynamoDB
-        response = table.scan()
-        matching_items = []
-        for item in response.get('Items', []):
-            if item.get('fileID') == file_id:
-                matching_items.append(item)
-        
-        if matching_items:
-            item = matching_items[0]
-            detections = item.get('detections', {})
-            
-            # Add or remove tags based on operation
-            for species, count in tag_dict.items():
-                if operation == 1:  # Add tags
-                    current_count = detections.get(species, 0)
-                    detections[species] = current_count + count
-                else:  # Remove tags
-                    if species in detections:
-                        current_count = detections[species]
-                        new_count = current_count - count
-                        if new_count <= 0:
-                            del detections[species]
-                        else:
-                            detections[species] = new_count
-            
-            # Update item in DynamoDB
-            item['detections'] = detections
-            table.put_item(Item=item)
-            updated_files.append(file_id)
+            file_ids.append(url.replace('s3://g146-a3/', ''))
+    
+    # Turn the operation into signed per-species deltas
+    sign = 1 if operation == 1 else -1
+    deltas = {species: sign * count for species, count in tag_dict.items()}
+    
+    # One atomic update per file, issued concurrently
+    updated_files = []
+    failed_files = []
+    index_updates = []
+    with ThreadPoolExecutor(max_workers=TAG_UPDATE_WORKERS) as executor:
+        results = executor.map(lambda file_id: apply_tag_deltas(file_id, deltas), file_ids)
+        for file_id, (item, error) in zip(file_ids, results):
+            if item:
+                index_updates.append((item, deltas))
+                updated_files.append(file_id)
+            elif error:
+                failed_files.append({'fileID': file_id, 'error': error})
+    
+    # Index items of species that dropped to zero are deleted as stale
+    sync_species_indexes(index_updates)
     
     return {
         'statusCode': 200,
         'body': json.dumps({
             'message': f'Successfully updated {len(updated_files)} files',
-            'updated_files': updated_files
+            'updated_files': updated_files,
+            'failed_files': failed_files
         }, cls=DecimalEncoder),
         'headers': {
             'Content-Type': 'application/json',
@@ -329,6 +362,84 @@ def handle_bulk_tags(event):
     }
 
 
+def apply_tag_deltas(file_id, deltas):
+    """
+    Add signed counts to detections.<species> server-side in a single
+    UpdateItem, then remove any species whose count dropped to zero or below.
+    Removing a species the file does not have is a no-op, not a negative
+    count. The record is stamped with tagsEditedAt so a redelivered
+    detection event does not overwrite the edit. Returns (updated item, None), (None, None) if the file does not exist, or
+    (None, error message).
+    """
+    client = table.meta.client
+    if not deltas:
+        return client.get_item(TableName=table.name, Key={'fileID': file_id}).get('Item'), None
+    
+    names = {}
+    values = {':zero': 0, ':now': int(time.time())}
+    assignments = ['#edited = :now']
+    conditions = ['attribute_exists(fileID)']
+    for i, (species, delta) in enumerate(deltas.items()):
+        names[f'#s{i}'] = species
+        values[f':d{i}'] = delta
+        # ADD cannot target nested map entries, so increment with if_not_exists instead
+        assignments.append(f'detections.#s{i} = if_not_exists(detections.#s{i}, :zero) + :d{i}')
+        if delta < 0:
+            conditions.append(f'attribute_exists(detections.#s{i})')
+    
+    try:
+        response = client.update_item(
+            TableName=table.name,
+            Key={'fileID': file_id},
+            UpdateExpression='SET ' + ', '.join(assignments),
+            ConditionExpression=' AND '.join(conditions),
+            ExpressionAttributeNames={**names, '#edited': EDITED_AT},
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW'
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        if len(conditions) == 1:
+            return None, None
+        # Missing file, or removal of a species the file does not have: drop those and retry
+        current = client.get_item(
+            TableName=table.name, Key={'fileID': file_id}, ConsistentRead=True
+        ).get('Item')
+        if not current:
+            return None, None
+        present = current.get('detections', {})
+        kept = {species: delta for species, delta in deltas.items() if delta > 0 or species in present}
+        if not kept:
+            return current, None
+        return apply_tag_deltas(file_id, kept)
+    except Exception as e:
+        print(f"Error updating tags for {file_id}: {str(e)}")
+        return None, str(e)
+    
+    item = response['Attributes']
+    detections = item.get('detections', {})
+    emptied = [placeholder for placeholder, species in names.items() if detections.get(species, 0) <= 0]
+    if emptied:
+        # Only remove counts that are still non-positive, in case another curator added some meanwhile
+        try:
+            client.update_item(
+                TableName=table.name,
+                Key={'fileID': file_id},
+                UpdateExpression='REMOVE ' + ', '.join(f'detections.{p}' for p in emptied),
+                ConditionExpression=' AND '.join(f'detections.{p} <= :zero' for p in emptied),
+                ExpressionAttributeNames={p: names[p] for p in emptied},
+                ExpressionAttributeValues={':zero': 0}
+            )
+            for placeholder in emptied:
+                del detections[names[placeholder]]
+        except client.exceptions.ConditionalCheckFailedException:
+            # A concurrent edit changed one of the counts; re-read the item as it is now
+            item = client.get_item(
+                TableName=table.name, Key={'fileID': file_id}, ConsistentRead=True
+            ).get('Item', item)
+    
+    return item, None
+
+
 def handle_file_deletion(event):
     """
     Delete files and their thumbnails from S3 and remove entries from DynamoDB.
@@ -357,34 +468,18 @@ def handle_file_deletion(event):
             }
         }
     
-    deleted_files = []
+    # Extract file IDs from URLs
+    file_ids = [url.replace('s3://g146-a3/', '') for url in urls if 's3://g146-a3/' in url]
     
-    for url in urls:
-        # Extract file ID from URL
-        if 's3://g146-a3/' in url:
-            file_id = url.replace('s3://g146-a3/', '')
-        else:
-            continue
-        
-        # Delete main file from S3
-        s3.delete_object(Bucket='g146-a3', Key=file_id)
-        
-        # For images, also delete thumbnail
-        file_extension = file_id.split('.')[-1].lower() if '.' in file_id else ''
-        if file_extension in ['jpg', 'jpeg', 'png']:
-            # Delete thumbnail from S3
-            thumbnail_key = f"thumbnails/{file_id.split('/')[-1]}"
-            s3.delete_object(Bucket='g146-a3', Key=thumbnail_key)
-        
-        # Delete record from DynamoDB
-        table.delete_item(Key={'fileID': file_id})
-        deleted_files.append(file_id)
+    # Originals, thumbnails, records and index entries go in batched, concurrent calls
+    deleted_files, failed_files = delete_files('g146-a3', table, file_ids)
     
     return {
         'statusCode': 200,
         'body': json.dumps({
             'message': f'Successfully deleted {len(deleted_files)} files',
-            'deleted_files': deleted_files
+            'deleted_files': deleted_files,
+            'failed_files': failed_files
         }, cls=DecimalEncoder),
         'headers': {
             'Content-Type': 'application/json',
@@ -1,5 +1,5 @@
 import boto3
-import os
+import io
 import json
 from urllib.parse import unquote_plus
 from PIL import Image
@@ -7,12 +7,15 @@ from PIL import Image
 s3 = boto3.client('s3')
 eventbridge = boto3.client('events')
 
-def generate_thumbnail(image_path, thumbnail_path, width=256):
-    with Image.open(image_path) as img:
+def generate_thumbnail(image_file, width=256):
+    """Return JPEG bytes of a `width` pixel wide thumbnail of an image path or file object."""
+    with Image.open(image_file) as img:
         aspect_ratio = img.height / img.width
         new_height = int(width * aspect_ratio)
         thumbnail = img.resize((width, new_height), Image.LANCZOS)
-        thumbnail.save(thumbnail_path, format='JPEG', quality=85)
+        output = io.BytesIO()
+        thumbnail.save(output, format='JPEG', quality=85)
+        return output.getvalue()
 
 def lambda_handler(event, context):
     bucket = event['Records'][0]['s3']['bucket']['name']
@@ -22,17 +25,13 @@ def lambda_handler(event, context):
         return { 'statusCode': 200, 'body': 'Not an image, skipping.' }
 
     filename = key.split('/')[-1]
-    tmp_image_path = f"/tmp/{filename}"
-    tmp_thumb_path = "/tmp/thumb.jpg"
     thumb_key = f"thumbnails/{filename}"
 
     try:
-        # Download original image
-        s3.download_file(bucket, key, tmp_image_path)
-
-        # Create thumbnail and upload
-        generate_thumbnail(tmp_image_path, tmp_thumb_path)
-        s3.upload_file(tmp_thumb_path, bucket, thumb_key)
+        # One GET into memory, no /tmp round trip; the thumbnail is uploaded from memory too
+        original = io.BytesIO(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+        thumbnail_bytes = generate_thumbnail(original)
+        s3.put_object(Bucket=bucket, Key=thumb_key, Body=thumbnail_bytes, ContentType='image/jpeg')
 
         # Send EventBridge event to notify tagging Lambda
         eventbridge.put_events(
@@ -42,7 +41,9 @@ def lambda_handler(event, context):
                 'Detail': json.dumps({
                     'bucket': bucket,
                     'key': key,
-                    'thumbnail_key': thumb_key
+                    'thumbnail_key': thumb_key,
+                    # Lets the tagging Lambda recognise redeliveries without a HEAD
+                    'etag': event['Records'][0]['s3']['object'].get('eTag')
                 }),
                 'EventBusName': 'default'
             }]